@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Compares the HTTP transport backends of toggl-fetch against a local stub server.
+
+For each available backend, this measures the per-request overhead (latency of sequential requests) and the
+throughput with several concurrent requests. The stub server answers every request immediately with a small JSON
+document (optionally after a fixed delay, to simulate report generation), so the numbers mostly reflect client-side
+overhead. Note that the stub server only speaks HTTP/1.1, so HTTP/2 multiplexing (httpx with h2 installed) is not
+exercised.
+
+Usage: python benchmarks/transport_benchmark.py [--requests N] [--concurrency N] [--delay SECONDS]
+
+This file is part of toggl-fetch, see https://github.com/Tblue/toggl-fetch.
+
+Copyright 2016  Tilman Blumenbach
+
+toggl-fetch is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+toggl-fetch is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
+"""
+
+import concurrent.futures
+import os.path
+import statistics
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+
+from toggl_fetch import transport
+
+
+# Response body sent by the stub server.
+STUB_BODY = b'{"total_grand": 3600000, "total_billable": null, "total_currencies": [], "data": []}'
+
+
+class _StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so that connection reuse can be measured.
+    protocol_version = "HTTP/1.1"
+
+    # Send headers and body in one segment; avoids delayed ACK stalls which would dwarf client overhead.
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    # Set by run_stub_server().
+    delay = 0
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(STUB_BODY)))
+        self.end_headers()
+        self.wfile.write(STUB_BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_stub_server(delay):
+    """Start the stub server in a background thread.
+
+    :param delay: Time (in seconds) to wait before answering each request.
+    :type delay: float
+    :return: The running server.
+    :rtype: http.server.HTTPServer
+    """
+    handler = type("StubHandler", (_StubHandler,), {"delay": delay})
+    server = _StubServer(("127.0.0.1", 0), handler)
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure_latency(backend, url, count):
+    """Perform sequential requests and return the latency of each one, in seconds."""
+    latencies = []
+
+    for _ in range(count):
+        start = time.perf_counter()
+        backend.get(url, {"workspace_id": 1}).json()
+        latencies.append(time.perf_counter() - start)
+
+    return latencies
+
+
+def measure_throughput(backend, url, count, concurrency):
+    """Perform requests using several threads and return the achieved requests per second."""
+    def request(_):
+        backend.get(url, {"workspace_id": 1}).json()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        list(executor.map(request, range(count)))
+        return count / (time.perf_counter() - start)
+
+
+def main():
+    argparser = ArgumentParser(description="Compare the HTTP transport backends of toggl-fetch")
+    argparser.add_argument("-n", "--requests", type=int, default=500, help="Requests per measurement.")
+    argparser.add_argument("-c", "--concurrency", type=int, default=8, help="Threads for the throughput measurement.")
+    argparser.add_argument("-d", "--delay", type=float, default=0, help="Server-side delay per request in seconds.")
+    args = argparser.parse_args()
+
+    server = run_stub_server(args.delay)
+    url = "http://127.0.0.1:%d/reports/api/v2/summary" % server.server_address[1]
+
+    print("%-10s %12s %12s %12s %14s" % ("backend", "mean (ms)", "p50 (ms)", "p95 (ms)", "throughput/s"))
+
+    for name in sorted(transport.TRANSPORTS):
+        try:
+            backend = transport.TRANSPORTS[name](("token", "api_token"), "toggl-fetch-benchmark")
+        except transport.TransportUnavailableError as e:
+            print("%-10s skipped: %s" % (name, e))
+            continue
+
+        try:
+            # Warm up (establish connections).
+            measure_latency(backend, url, 10)
+
+            latencies = sorted(measure_latency(backend, url, args.requests))
+            throughput = measure_throughput(backend, url, args.requests, args.concurrency)
+        finally:
+            backend.close()
+
+        print("%-10s %12.3f %12.3f %12.3f %14.1f" % (
+                name,
+                statistics.mean(latencies) * 1000,
+                statistics.median(latencies) * 1000,
+                latencies[int(len(latencies) * 0.95) - 1] * 1000,
+                throughput
+        ))
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
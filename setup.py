@@ -23,7 +23,8 @@ setup(
     author_email="tilman+pypi@ax86.net",
     entry_points={
         "console_scripts": [
-            "toggl-fetch = toggl_fetch.fetch:main"
+            "toggl-fetch = toggl_fetch.fetch:main",
+            "toggl-aggregate = toggl_fetch.aggregate:main"
         ]
     },
     url="https://github.com/Tblue/toggl-fetch",
@@ -33,6 +34,10 @@ setup(
         "python-dateutil ~= 2.0",
         "pyxdg ~= 0.26"
     ],
+    extras_require={
+        "fast-aggregation": ["numpy"],
+        "httpx": ["httpx[http2]"]
+    },
     setup_requires=["setuptools_scm ~= 1.10"],
     classifiers=[
         "Development Status :: 5 - Production/Stable",
@@ -0,0 +1,151 @@
+"""Tests for the local aggregation of report data (see toggl-aggregate).
+
+The NumPy and the pure Python implementations must give the same results.
+
+This file is part of toggl-fetch, see https://github.com/Tblue/toggl-fetch.
+
+Copyright 2016  Tilman Blumenbach
+
+toggl-fetch is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+toggl-fetch is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
+"""
+
+import datetime
+import itertools
+import json
+import os.path
+import random
+import tempfile
+import unittest
+import unittest.mock
+
+from toggl_fetch import aggregate
+
+
+KEY_COMBINATIONS = [(), ("client",), ("project", "user"), ("client", "project", "user", "currency")]
+BUCKET_CHOICES = [None] + list(aggregate.BUCKETS)
+
+
+def make_table(size, seed=0):
+    generator = random.Random(seed)
+    table = aggregate.EntryTable()
+    first_day = datetime.date(2016, 1, 1)
+
+    for _ in range(size):
+        table.add(
+                generator.choice(["ACME", "Initech", None]),
+                "project %d" % generator.randrange(12),
+                generator.choice(["Ann", "Bob", "Carol"]),
+                generator.choice(["EUR", "USD"]),
+                # Some records without a date, like those of summary reports.
+                first_day + datetime.timedelta(generator.randrange(400)) if generator.random() < 0.9 else None,
+                generator.randrange(1, 8 * 3600000),
+                round(generator.random() * 100, 2),
+                generator.random() < 0.6
+        )
+
+    return table
+
+
+@unittest.skipIf(aggregate.numpy is None, "NumPy is not installed")
+class NumpyEquivalenceTest(unittest.TestCase):
+    def assertSameGroups(self, expected, actual):
+        self.assertEqual([(key, time) for key, time, _ in actual], [(key, time) for key, time, _ in expected])
+
+        # Sums of floats depend on the order of the additions.
+        for (_, _, expected_amount), (_, _, actual_amount) in zip(expected, actual):
+            self.assertAlmostEqual(actual_amount, expected_amount, places=6)
+
+    def compare(self, table, method):
+        for keys, bucket, billable_only in itertools.product(KEY_COMBINATIONS, BUCKET_CHOICES, (False, True)):
+            with self.subTest(keys=keys, bucket=bucket, billable_only=billable_only):
+                with_numpy = getattr(table, method)(keys, bucket, billable_only)
+
+                with unittest.mock.patch.object(aggregate, "numpy", None):
+                    without_numpy = getattr(table, method)(keys, bucket, billable_only)
+
+                self.assertSameGroups(without_numpy, with_numpy)
+
+    def test_group_by(self):
+        self.compare(make_table(2000), "group_by")
+
+    def test_rollup(self):
+        self.compare(make_table(2000), "rollup")
+
+    def test_empty_table(self):
+        self.compare(aggregate.EntryTable(), "group_by")
+        self.compare(aggregate.EntryTable(), "rollup")
+
+    def test_nothing_billable(self):
+        table = aggregate.EntryTable()
+        table.add("ACME", "Website", "Ann", "EUR", datetime.date(2016, 1, 1), 3600000, 0, False)
+
+        self.compare(table, "group_by")
+        self.assertEqual(table.group_by(["client"], billable_only=True), [])
+
+
+class GroupByTest(unittest.TestCase):
+    def test_group_by_month(self):
+        table = aggregate.EntryTable()
+        table.add("ACME", "Website", "Ann", "EUR", datetime.date(2016, 1, 31), 3600000, 10.0, True)
+        table.add("ACME", "Website", "Bob", "EUR", datetime.date(2016, 1, 2), 1800000, 5.0, True)
+        table.add("ACME", "Website", "Ann", "EUR", datetime.date(2016, 2, 1), 600000, 0.0, False)
+        table.add("ACME", "Website", "Ann", "EUR", None, 60000, 0.0, False)
+
+        self.assertEqual(table.group_by(["client"], "month"), [
+            (("ACME", datetime.date(2016, 1, 1)), 5400000, 15.0),
+            (("ACME", datetime.date(2016, 2, 1)), 600000, 0.0),
+            (("ACME", None), 60000, 0.0),
+        ])
+        self.assertEqual(table.rollup(["client", "user"], billable_only=True), [
+            (("ACME", "Ann"), 3600000, 10.0),
+            (("ACME", "Bob"), 1800000, 5.0),
+            (("ACME", None), 5400000, 15.0),
+            ((None, None), 5400000, 15.0),
+        ])
+
+
+class LoadFileTest(unittest.TestCase):
+    SUMMARY = {
+        "total_grand": 3600000,
+        "data": [{
+            "title": {"project": "Website", "client": "ACME"},
+            "items": [{"title": {"user": "Ann"}, "time": 3600000, "sum": 10.0, "cur": "EUR"}],
+        }],
+    }
+
+    def load(self, data, require_dates):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "report.json")
+            with open(path, "w", encoding="utf-8") as fh:
+                json.dump(data, fh)
+
+            table = aggregate.EntryTable()
+            aggregate.load_file(table, path, require_dates)
+
+            return table
+
+    def test_summary_without_dates(self):
+        table = self.load(self.SUMMARY, require_dates=False)
+        self.assertEqual(table.group_by(["project"]), [(("Website",), 3600000, 10.0)])
+
+        with self.assertRaises(ValueError):
+            self.load(self.SUMMARY, require_dates=True)
+
+    def test_summary_with_since(self):
+        table = self.load(dict(self.SUMMARY, since="2016-08-01"), require_dates=True)
+        self.assertEqual(table.group_by([], "month"), [((datetime.date(2016, 8, 1),), 3600000, 10.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+"""Tests for hedged requests (see --hedge), using a local stub server.
+
+This file is part of toggl-fetch, see https://github.com/Tblue/toggl-fetch.
+
+Copyright 2016  Tilman Blumenbach
+
+toggl-fetch is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+toggl-fetch is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
+"""
+
+import itertools
+import json
+import threading
+import time
+import unittest
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from toggl_fetch import api
+
+
+class _StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Answers every request with an empty summary report. The first ``slow_requests`` requests take ``delay``
+    seconds.
+    """
+    slow_requests = 0
+    delay = 0
+    counter = itertools.count()
+
+    def do_GET(self):
+        if next(self.counter) < self.slow_requests:
+            time.sleep(self.delay)
+
+        body = json.dumps({"total_grand": None, "data": []}).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HedgingTest(unittest.TestCase):
+    def setUp(self):
+        self.server = _StubServer(("127.0.0.1", 0), _StubHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        _StubHandler.counter = itertools.count()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_client(self):
+        base_url = "http://127.0.0.1:%d/reports/api/v2/" % self.server.server_address[1]
+
+        class StubTogglReports(api.TogglReports):
+            API_BASE_URL = base_url
+
+        # A unique token, so that the client does not share its rate limiter with the other tests. The rate limiter
+        # allows a hedged request after one second, so hedge_min_delay must not be lower than that.
+        client = StubTogglReports(uuid.uuid4().hex, hedge=True, hedge_min_samples=5, hedge_min_delay=1.0)
+        client.add_latency_samples({base_url + "summary": [0.01] * 5})
+
+        return client
+
+    def test_hedge_wins_over_slow_primary(self):
+        _StubHandler.slow_requests = 1
+        _StubHandler.delay = 3
+
+        client = self.make_client()
+
+        start = time.monotonic()
+        self.assertEqual(client.get_summary(workspace_id=1), {"total_grand": None, "data": []})
+        self.assertLess(time.monotonic() - start, 2.5)
+
+        stats = client.hedge_stats
+        self.assertEqual((stats["requests"], stats["hedged"], stats["hedge_won"]), (1, 1, 1))
+
+        # The elapsed time of the primary request is recorded, not the (fast) latency of the hedged request.
+        latencies = list(client.get_latency_samples().values())[0]
+        self.assertGreaterEqual(latencies[-1], 1.0)
+
+        # The slow primary request is still running, but must not keep the program from exiting.
+        blocking = [thread for thread in threading.enumerate() if not thread.daemon]
+        self.assertEqual(blocking, [threading.main_thread()])
+
+    def test_fast_request_is_not_hedged(self):
+        _StubHandler.slow_requests = 0
+
+        client = self.make_client()
+        client.get_summary(workspace_id=1)
+
+        stats = client.hedge_stats
+        self.assertEqual((stats["requests"], stats["hedged"]), (1, 0))
+
+    def test_latency_samples_carry_over(self):
+        client = self.make_client()
+        samples = client.get_latency_samples()
+
+        other = self.make_client()
+        other.add_latency_samples(samples)
+
+        for url, latencies in other.get_latency_samples().items():
+            self.assertEqual(latencies, samples[url] * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Tests for the file-based response cache (see --max-cache-age and --prefetch).
+
+This file is part of toggl-fetch, see https://github.com/Tblue/toggl-fetch.
+
+Copyright 2016  Tilman Blumenbach
+
+toggl-fetch is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+toggl-fetch is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
+"""
+
+import os
+import os.path
+import tempfile
+import time
+import unittest
+
+from toggl_fetch import cache
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.path = self._tmp_dir.name
+        self.cache = cache.ResponseCache(self.path)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def age(self, file_name, seconds):
+        path = os.path.join(self.path, file_name)
+        mtime = time.time() - seconds
+        os.utime(path, (mtime, mtime))
+
+    def test_put_and_get(self):
+        self.assertIsNone(self.cache.get(["summary", 1]))
+
+        self.cache.put(["summary", 1], b"data")
+        entry = self.cache.get(["summary", 1])
+
+        self.assertEqual(entry.data, b"data")
+        self.assertLess(entry.age, 5)
+
+    def test_prune(self):
+        self.cache.put(["summary", "old"], b"old")
+        self.cache.put(["summary", "new"], b"new")
+        old_file = os.path.basename(self.cache._file(["summary", "old"]))
+        self.age(old_file, 3600)
+
+        # A temporary file left behind by an interrupted write, and an unrelated file.
+        for file_name in ("leftover.cache.1.2.tmp", "README"):
+            open(os.path.join(self.path, file_name), "w").close()
+            self.age(file_name, 3600)
+
+        self.assertEqual(self.cache.prune(60), 2)
+
+        self.assertIsNone(self.cache.get(["summary", "old"]))
+        self.assertEqual(self.cache.get(["summary", "new"]).data, b"new")
+        self.assertEqual(len(os.listdir(self.path)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
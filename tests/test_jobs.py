@@ -0,0 +1,211 @@
+"""Tests for the job runner (see --jobs) and the deadline-aware rate limiter it relies on.
+
+This file is part of toggl-fetch, see https://github.com/Tblue/toggl-fetch.
+
+Copyright 2016  Tilman Blumenbach
+
+toggl-fetch is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+toggl-fetch is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
+"""
+
+import threading
+import time
+import unittest
+
+from toggl_fetch import api
+from toggl_fetch import jobs
+
+
+class JobRunnerTest(unittest.TestCase):
+    def setUp(self):
+        self.started = []
+
+    def job(self, name, duration=0, status=0):
+        def run(cancel):
+            self.started.append(name)
+
+            # Stop early if cancelled, like a job checking its cancel event before writing output.
+            if cancel.wait(duration):
+                return 6
+
+            return status
+
+        return run
+
+    def outcomes(self, results):
+        return {result.name: result.outcome for result in results}
+
+    def test_earliest_deadline_first(self):
+        now = time.time()
+        runner = jobs.JobRunner(concurrency=1)
+        runner.add(jobs.Job("late", self.job("late"), now + 30))
+        runner.add(jobs.Job("early", self.job("early"), now + 10))
+        runner.add(jobs.Job("early-urgent", self.job("early-urgent"), now + 10, priority=1))
+
+        results = runner.run()
+
+        self.assertEqual(self.started, ["early-urgent", "early", "late"])
+        self.assertEqual(set(self.outcomes(results).values()), {jobs.OUTCOME_OK})
+
+    def test_skip_by_estimate(self):
+        now = time.time()
+        runner = jobs.JobRunner()
+        runner.add(jobs.Job("hopeless", self.job("hopeless"), now + 1, estimate=5))
+        runner.add(jobs.Job("feasible", self.job("feasible"), now + 10, estimate=1))
+
+        results = runner.run()
+
+        self.assertEqual(self.started, ["feasible"])
+        self.assertEqual(self.outcomes(results), {"hopeless": jobs.OUTCOME_SKIPPED, "feasible": jobs.OUTCOME_OK})
+
+        skipped = next(result for result in results if result.name == "hopeless")
+        self.assertIsNone(skipped.wait)
+        self.assertIsNone(skipped.duration)
+
+    def test_skip_by_mean_duration(self):
+        # Without an estimate, the duration of the first job predicts that the second one cannot make it.
+        now = time.time()
+        runner = jobs.JobRunner(concurrency=1)
+        runner.add(jobs.Job("first", self.job("first", 0.3), now + 1))
+        runner.add(jobs.Job("second", self.job("second", 0.3), now + 1.5))
+
+        results = runner.run()
+
+        self.assertEqual(self.outcomes(results), {"first": jobs.OUTCOME_OK, "second": jobs.OUTCOME_OK})
+
+        now = time.time()
+        runner.add(jobs.Job("third", self.job("third", 0.3), now + 0.2))
+
+        self.assertEqual(self.outcomes(runner.run()), {"third": jobs.OUTCOME_SKIPPED})
+        self.assertNotIn("third", self.started)
+
+    def test_timeout_cancels_job(self):
+        cancelled = threading.Event()
+
+        def run(cancel):
+            cancel.wait(5)
+            if cancel.is_set():
+                cancelled.set()
+
+            return 0
+
+        now = time.time()
+        runner = jobs.JobRunner(concurrency=1)
+        runner.add(jobs.Job("slow", run, now + 0.2))
+        runner.add(jobs.Job("next", self.job("next"), now + 10))
+
+        results = runner.run()
+
+        self.assertEqual(self.outcomes(results), {"slow": jobs.OUTCOME_TIMED_OUT, "next": jobs.OUTCOME_OK})
+        self.assertTrue(cancelled.wait(1))
+
+        timed_out = next(result for result in results if result.name == "slow")
+        self.assertIsNone(timed_out.status)
+        self.assertLess(timed_out.duration, 1)
+
+    def test_failures(self):
+        def crash(cancel):
+            raise RuntimeError("crashed")
+
+        now = time.time()
+        runner = jobs.JobRunner()
+        runner.add(jobs.Job("error", self.job("error", status=3), now + 10))
+        runner.add(jobs.Job("crash", crash, now + 10))
+
+        results = {result.name: result for result in runner.run()}
+
+        self.assertEqual(results["error"].outcome, jobs.OUTCOME_FAILED)
+        self.assertEqual(results["error"].status, 3)
+        self.assertEqual(results["crash"].outcome, jobs.OUTCOME_FAILED)
+        self.assertIsInstance(results["crash"].error, RuntimeError)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_waiters_are_served_in_deadline_order(self):
+        limiter = api.RateLimiter(rate=20)
+        limiter.acquire()
+
+        order = []
+
+        def wait_for_token(name, deadline, priority):
+            if deadline is None:
+                limiter.acquire()
+            else:
+                with api.request_urgency(deadline, priority):
+                    limiter.acquire()
+
+            order.append(name)
+
+        threads = [
+            threading.Thread(target=wait_for_token, args=args)
+            for args in [("none", None, 0), ("late", 200, 0), ("early", 100, 0), ("early-urgent", 100, 1)]
+        ]
+        for thread in threads:
+            thread.start()
+            # Let each thread start waiting before the next one does.
+            time.sleep(0.01)
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(order, ["early-urgent", "early", "late", "none"])
+
+    def test_cancelled_waiter_gives_up_its_turn(self):
+        limiter = api.RateLimiter(rate=2)
+        limiter.acquire()
+
+        cancel = threading.Event()
+        outcomes = {}
+
+        def wait_for_token(name, deadline, cancel=None):
+            with api.request_urgency(deadline, cancel=cancel):
+                try:
+                    limiter.acquire()
+                    outcomes[name] = "acquired"
+                except api.RequestCancelledError:
+                    outcomes[name] = "cancelled"
+
+        # The cancelled thread has the earlier deadline, so it would get the next token.
+        threads = [
+            threading.Thread(target=wait_for_token, args=("timed out", 100, cancel)),
+            threading.Thread(target=wait_for_token, args=("live", 200)),
+        ]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.01)
+
+        cancel.set()
+        threads[0].join(1)
+        self.assertEqual(outcomes, {"timed out": "cancelled"})
+
+        threads[1].join()
+        self.assertEqual(outcomes, {"timed out": "cancelled", "live": "acquired"})
+
+        # The token went to the live thread, and no other token was used up.
+        self.assertFalse(limiter.try_acquire())
+
+    def test_bind_request_urgency(self):
+        cancel = threading.Event()
+        with api.request_urgency(100, 1, cancel):
+            bound = api.bind_request_urgency(api._get_urgency)
+
+        result = []
+        thread = threading.Thread(target=lambda: result.append(bound()))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(result, [(100, 1, cancel)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+"""Tests for the coordination of workers in the shard module (see --shard).
+
+The workers run as threads, each with its own LeaseDirectory object, on a temporary directory.
+
+This file is part of toggl-fetch, see https://github.com/Tblue/toggl-fetch.
+
+Copyright 2016  Tilman Blumenbach
+
+toggl-fetch is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+toggl-fetch is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
+"""
+
+import collections
+import concurrent.futures
+import tempfile
+import threading
+import time
+import unittest
+
+from toggl_fetch import shard
+
+
+JOBS = ["workspace-%d" % number for number in range(8)]
+RUN = "2016-08-01"
+
+
+class LeaseDirectoryTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.path = self._tmp_dir.name
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_claim_is_exclusive(self):
+        first = shard.LeaseDirectory(self.path, ttl=60)
+        second = shard.LeaseDirectory(self.path, ttl=60)
+
+        self.assertTrue(first.claim("job", "0"))
+        self.assertFalse(second.claim("job", "1"))
+
+        first.release("job", "0")
+        self.assertTrue(second.claim("job", "1"))
+
+    def test_expired_lease_is_broken(self):
+        first = shard.LeaseDirectory(self.path, ttl=0.2)
+        second = shard.LeaseDirectory(self.path, ttl=0.2)
+
+        self.assertTrue(first.claim("job", "0"))
+        time.sleep(0.3)
+        self.assertTrue(second.claim("job", "1"))
+
+        # The first worker lost its lease and must neither renew nor remove the second worker's lease.
+        self.assertFalse(first.renew("job", "0"))
+        first.release("job", "0")
+        self.assertTrue(second.renew("job", "1"))
+        self.assertFalse(shard.LeaseDirectory(self.path, ttl=0.2).claim("job", "2"))
+
+    def test_renewed_lease_is_not_broken(self):
+        first = shard.LeaseDirectory(self.path, ttl=0.3)
+        second = shard.LeaseDirectory(self.path, ttl=0.3)
+
+        self.assertTrue(first.claim("job", "0"))
+        for _ in range(4):
+            time.sleep(0.1)
+            self.assertTrue(first.renew("job", "0"))
+
+        self.assertFalse(second.claim("job", "1"))
+
+
+class RunShardedTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.path = self._tmp_dir.name
+
+        self.calls = collections.Counter()
+        self.calls_lock = threading.Lock()
+        self.failing = set()
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def run_job(self, job):
+        with self.calls_lock:
+            self.calls[job] += 1
+
+        time.sleep(0.01)
+        return 3 if job in self.failing else 0
+
+    def run_worker(self, worker_index, worker_count=2, ttl=60):
+        return shard.run_sharded(
+                JOBS,
+                self.run_job,
+                shard.LeaseDirectory(self.path, ttl=ttl),
+                worker_index,
+                worker_count,
+                RUN,
+                poll_interval=0.05
+        )
+
+    def test_two_workers_split_jobs(self):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(self.run_worker, range(2)))
+
+        # Every job ran exactly once, on the worker it is assigned to.
+        self.assertEqual(self.calls, collections.Counter(JOBS))
+        self.assertEqual(sorted(list(results[0]) + list(results[1])), sorted(JOBS))
+
+        ring = shard.HashRing(["0", "1"])
+        for worker_index, worker_results in enumerate(results):
+            for job in worker_results:
+                self.assertEqual(ring.get_worker(job), str(worker_index))
+
+    def test_takeover_from_dead_worker(self):
+        # Worker 1 claims one of its jobs and dies without finishing it or sending heartbeats.
+        ring = shard.HashRing(["0", "1"])
+        abandoned = next(job for job in JOBS if ring.get_worker(job) == "1")
+        self.assertTrue(shard.LeaseDirectory(self.path, ttl=0.3).claim(abandoned, "1"))
+
+        results = self.run_worker(0, ttl=0.3)
+
+        self.assertEqual(sorted(results), sorted(JOBS))
+        self.assertEqual(self.calls, collections.Counter(JOBS))
+
+    def test_failed_job_is_retried_on_next_invocation(self):
+        self.failing = {JOBS[0]}
+        results = self.run_worker(0, worker_count=1)
+
+        self.assertEqual(results[JOBS[0]], 3)
+        self.assertEqual(self.calls, collections.Counter(JOBS))
+
+        # Only the failed job runs again; finished jobs are not repeated.
+        self.failing = set()
+        results = self.run_worker(0, worker_count=1)
+
+        self.assertEqual(results, {JOBS[0]: 0})
+        self.assertEqual(self.calls[JOBS[0]], 2)
+
+        # Now that it finished, nothing is left to do.
+        self.assertEqual(self.run_worker(0, worker_count=1), {})
+
+    def test_failed_job_is_not_retried_by_other_worker(self):
+        self.failing = set(JOBS)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(self.run_worker, range(2)))
+
+        self.assertEqual(self.calls, collections.Counter(JOBS))
+        self.assertEqual(set(results[0].values()) | set(results[1].values()), {3})
+
+
+if __name__ == "__main__":
+    unittest.main()
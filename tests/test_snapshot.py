@@ -0,0 +1,71 @@
+"""Tests for the report snapshots and the differences between them (see --diff).
+
+This file is part of toggl-fetch, see https://github.com/Tblue/toggl-fetch.
+
+Copyright 2016  Tilman Blumenbach
+
+toggl-fetch is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+toggl-fetch is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
+"""
+
+import unittest
+
+from toggl_fetch import snapshot
+
+
+def make_summary(*amounts):
+    return {
+        "total_grand": 3600000 * len(amounts),
+        "data": [{
+            "title": {"project": "Website", "client": "ACME"},
+            "items": [{"title": {"user": "Ann"}, "time": 3600000, "sum": amount, "cur": "EUR"} for amount in amounts],
+        }],
+    }
+
+
+class DiffSnapshotsTest(unittest.TestCase):
+    def make_snapshot(self, *amounts):
+        return snapshot.make_snapshot(make_summary(*amounts), 1, "2016-08-01", "2016-08-31")
+
+    def test_amounts_are_rounded(self):
+        new = self.make_snapshot(0.1, 0.2)
+        self.assertEqual(new["rows"][0][5], 0.3)
+
+        # The same amount, summed up in a different order, is not a change.
+        self.assertTrue(snapshot.is_empty_diff(snapshot.diff_snapshots(self.make_snapshot(0.2, 0.1), new)))
+
+    def test_old_snapshot_with_unrounded_amounts(self):
+        old = self.make_snapshot(0.3)
+        old["rows"][0][5] = 0.1 + 0.2
+
+        self.assertTrue(snapshot.is_empty_diff(snapshot.diff_snapshots(old, self.make_snapshot(0.3))))
+
+    def test_deltas(self):
+        diff = snapshot.diff_snapshots(self.make_snapshot(0.1), self.make_snapshot(0.1, 0.3))
+
+        self.assertEqual(len(diff["changed"]), 1)
+        self.assertEqual(diff["changed"][0]["amount_delta"], 0.3)
+        self.assertEqual(diff["changed"][0]["time_delta"], 3600000)
+        self.assertEqual(diff["totals"]["amount"], {"EUR": 0.4})
+        self.assertEqual(diff["totals"]["amount_delta"], {"EUR": 0.3})
+
+    def test_no_previous_snapshot(self):
+        diff = snapshot.diff_snapshots(None, self.make_snapshot(10))
+
+        self.assertIsNone(diff["previous"])
+        self.assertEqual([row["amount"] for row in diff["added"]], [10])
+        self.assertEqual(diff["totals"]["amount_delta"], {"EUR": 10})
+
+
+if __name__ == "__main__":
+    unittest.main()
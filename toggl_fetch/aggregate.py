@@ -0,0 +1,519 @@
+"""Aggregates saved Toggl.com report data locally, without using the API - console-based frontend.
+
+Report data (summary or detailed reports in the JSON format of the Toggl.com reports API) is loaded into a
+column-oriented table with interned client, project and user names. Group-by sums, rollups and date bucketing are then
+computed over the columns; if NumPy is installed, these are vectorized operations.
+
+This file is part of toggl-fetch, see https://github.com/Tblue/toggl-fetch.
+
+Copyright 2016  Tilman Blumenbach
+
+toggl-fetch is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+toggl-fetch is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
+"""
+
+import csv
+import datetime
+import json
+import logging
+import sys
+from argparse import ArgumentParser
+from array import array
+
+import dateutil.parser
+
+from . import app_version
+from . import report
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Columns which can be used as group-by keys.
+KEY_COLUMNS = ("client", "project", "user", "currency")
+
+# Supported date buckets.
+BUCKETS = ("day", "week", "month", "year")
+
+# Ordinal of 1970-01-01, used to convert ordinals to NumPy dates.
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+class _Interner:
+    """Maps strings to small consecutive integers (and back)."""
+    def __init__(self):
+        self._ids = {}
+        self.names = []
+
+    def __call__(self, name):
+        try:
+            return self._ids[name]
+        except KeyError:
+            self._ids[name] = len(self.names)
+            self.names.append(name)
+            return self._ids[name]
+
+
+class EntryTable:
+    """A column-oriented table of time records.
+
+    Each record has a client, project, user and currency (stored as interned IDs), a day (stored as a proleptic
+    Gregorian ordinal, 0 if unknown), a duration in milliseconds, an amount and a billable flag.
+    """
+    def __init__(self):
+        self._interners = {column: _Interner() for column in KEY_COLUMNS}
+        self._columns = {
+            "client": array("l"),
+            "project": array("l"),
+            "user": array("l"),
+            "currency": array("l"),
+            "day": array("l"),
+            "time": array("q"),
+            "amount": array("d"),
+            "billable": array("b"),
+        }
+
+    def __len__(self):
+        return len(self._columns["time"])
+
+    def add(self, client, project, user, currency, day, time, amount, billable):
+        """Add a single record.
+
+        :param client: Client name.
+        :type client: str
+        :param project: Project name.
+        :type project: str
+        :param user: User name.
+        :type user: str
+        :param currency: Currency of ``amount``.
+        :type currency: str
+        :param day: Day of the record or ``None`` if unknown.
+        :type day: datetime.date | None
+        :param time: Duration in milliseconds.
+        :type time: int
+        :param amount: Billable amount.
+        :type amount: float
+        :param billable: Whether the record is billable.
+        :type billable: bool
+        :return: Nothing.
+        :rtype: None
+        """
+        columns = self._columns
+
+        columns["client"].append(self._interners["client"](client or report.NONE_TITLE))
+        columns["project"].append(self._interners["project"](project or report.NONE_TITLE))
+        columns["user"].append(self._interners["user"](user or report.NONE_TITLE))
+        columns["currency"].append(self._interners["currency"](currency or ""))
+        columns["day"].append(day.toordinal() if day is not None else 0)
+        columns["time"].append(time or 0)
+        columns["amount"].append(amount or 0)
+        columns["billable"].append(bool(billable))
+
+    def add_summary(self, summary, day=None):
+        """Add the records of a summary report (requested using :const:`.report.SUMMARY_PARAMS`).
+
+        Summary reports contain neither dates nor billable flags: All records are assigned to ``day`` and records
+        with a non-zero amount are treated as billable.
+
+        :param summary: Summary report as returned by :meth:`.api.TogglReports.get_summary`.
+        :type summary: dict
+        :param day: Day to assign the records to, usually the first day of the report period.
+        :type day: datetime.date | None
+        :return: Nothing.
+        :rtype: None
+        """
+        for row in report.flatten_summary(summary):
+            self.add(row.client, row.project, row.user, row.currency, day, row.time, row.amount, row.amount != 0)
+
+    def add_snapshot(self, snap):
+        """Add the records of a snapshot (see :func:`.snapshot.make_snapshot`).
+
+        Like for summary reports, records are assigned to the first day of the period and records with a non-zero
+        amount are treated as billable.
+
+        :param snap: The snapshot.
+        :type snap: dict
+        :return: Nothing.
+        :rtype: None
+        :raises ValueError: If the snapshot has an invalid start date.
+        """
+        day = dateutil.parser.parse(snap["since"]).date()
+
+        for client, project, user, currency, time, amount in snap["rows"]:
+            self.add(client, project, user, currency, day, time, amount, amount != 0)
+
+    def add_details(self, details):
+        """Add the time entries of a detailed report.
+
+        See https://github.com/toggl/toggl_api_docs/blob/master/reports/detailed.md#response
+
+        :param details: Detailed report (a single page or several pages merged into one ``data`` list).
+        :type details: dict
+        :return: Nothing.
+        :rtype: None
+        :raises ValueError: If a time entry has an invalid start date.
+        """
+        # Start dates are given in the user's timezone, so the day is simply the date part. Parsing full timestamps is
+        # slow and there are only few distinct days, so cache the parsed dates.
+        days = {}
+
+        for entry in details.get("data", []):
+            day_string = entry["start"][:10]
+            if day_string not in days:
+                days[day_string] = dateutil.parser.parse(day_string).date()
+
+            self.add(
+                    entry.get("client"),
+                    entry.get("project"),
+                    entry.get("user"),
+                    entry.get("cur"),
+                    days[day_string],
+                    entry.get("dur"),
+                    entry.get("billable"),
+                    entry.get("is_billable")
+            )
+
+    def _bucket_days(self, bucket, mask):
+        """Compute the bucket (as the ordinal of the first day of the bucket) of each selected record.
+
+        :return: Sequence of ordinals.
+        """
+        days = self._columns["day"]
+
+        if numpy is not None:
+            days = numpy.frombuffer(days, dtype=days.typecode)[mask]
+            known = days != 0
+
+            if bucket == "day":
+                return days
+            if bucket == "week":
+                # Ordinal 1 (0001-01-01) is a Monday, so this yields the Monday of each week.
+                return numpy.where(known, days - (days - 1) % 7, 0)
+
+            dates = (days - _EPOCH_ORDINAL).astype("datetime64[D]")
+            starts = dates.astype("datetime64[M]" if bucket == "month" else "datetime64[Y]").astype("datetime64[D]")
+            return numpy.where(known, starts.astype("int64") + _EPOCH_ORDINAL, 0)
+
+        # Pure Python: Compute the bucket once per distinct day.
+        cache = {0: 0}
+        result = array("l")
+
+        for day, selected in zip(days, mask):
+            if not selected:
+                continue
+
+            if day not in cache:
+                date = datetime.date.fromordinal(day)
+
+                if bucket == "week":
+                    date -= datetime.timedelta(date.weekday())
+                elif bucket == "month":
+                    date = date.replace(day=1)
+                elif bucket == "year":
+                    date = date.replace(month=1, day=1)
+
+                cache[day] = date.toordinal()
+
+            result.append(cache[day])
+
+        return result
+
+    def group_by(self, keys=(), bucket=None, billable_only=False):
+        """Compute total durations and amounts per group.
+
+        :param keys: Columns to group by, see :const:`KEY_COLUMNS`.
+        :type keys: collections.abc.Sequence[str]
+        :param bucket: Additionally group by date bucket (one of :const:`BUCKETS`), or ``None``.
+        :type bucket: str | None
+        :param billable_only: Only include billable records.
+        :type billable_only: bool
+        :return: List of ``(key, time, amount)`` tuples, sorted by key. ``key`` is a tuple of the key column values,
+            followed by the first day of the bucket (``None`` if unknown) if ``bucket`` is given. ``time`` is given in
+            milliseconds.
+        :rtype: list[(tuple, int, float)]
+        """
+        for key in keys:
+            if key not in KEY_COLUMNS:
+                raise ValueError("Cannot group by column: %s" % key)
+
+        if bucket is not None and bucket not in BUCKETS:
+            raise ValueError("Invalid date bucket: %s" % bucket)
+
+        if numpy is not None:
+            groups = self._group_by_numpy(keys, bucket, billable_only)
+        else:
+            groups = self._group_by_python(keys, bucket, billable_only)
+
+        result = []
+        for ids, time, amount in groups:
+            key = tuple(self._interners[column].names[id_] for column, id_ in zip(keys, ids))
+            if bucket is not None:
+                key += (datetime.date.fromordinal(ids[-1]) if ids[-1] else None,)
+
+            result.append((key, time, amount))
+
+        result.sort(key=lambda group: tuple((value is None, value) for value in group[0]))
+        return result
+
+    def _group_by_numpy(self, keys, bucket, billable_only):
+        columns = {name: numpy.frombuffer(column, dtype=column.typecode) for name, column in self._columns.items()}
+
+        if billable_only:
+            mask = columns["billable"] != 0
+        else:
+            mask = numpy.ones(len(self), dtype=bool)
+
+        times = columns["time"][mask]
+        amounts = columns["amount"][mask]
+
+        if not len(times):
+            return []
+
+        if not keys and bucket is None:
+            return [((), int(times.sum()), float(amounts.sum()))]
+
+        # Combine the key columns into a single integer key (mixed radix, using the number of interned names of each
+        # column), since numpy.unique() is much faster on a 1-D array than on the rows of a 2-D array. Buckets are
+        # numbered first, so that their radix is small.
+        key_columns = [columns[key][mask].astype("int64") for key in keys]
+        radices = [len(self._interners[key].names) for key in keys]
+
+        if bucket is not None:
+            bucket_days, bucket_ids = numpy.unique(self._bucket_days(bucket, mask), return_inverse=True)
+            key_columns.append(bucket_ids.reshape(-1).astype("int64"))
+            radices.append(len(bucket_days))
+
+        product = 1
+        for radix in radices:
+            product *= radix
+        if product >= 2 ** 63:
+            # Too many combinations for a 64 bit key.
+            return self._group_by_python(keys, bucket, billable_only)
+
+        combined = numpy.zeros(len(times), dtype="int64")
+        for column, radix in zip(key_columns, radices):
+            combined = combined * radix + column
+
+        unique_keys, inverse = numpy.unique(combined, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        time_sums = numpy.bincount(inverse, weights=times, minlength=len(unique_keys))
+        amount_sums = numpy.bincount(inverse, weights=amounts, minlength=len(unique_keys))
+
+        # Decode the combined keys, last column first.
+        decoded = []
+        for radix in reversed(radices):
+            decoded.append(unique_keys % radix)
+            unique_keys = unique_keys // radix
+        decoded.reverse()
+
+        if bucket is not None:
+            decoded[-1] = bucket_days[decoded[-1]]
+
+        # Convert whole columns at once, converting single NumPy values is slow.
+        return list(zip(
+                zip(*(column.tolist() for column in decoded)),
+                time_sums.astype("int64").tolist(),
+                amount_sums.tolist()
+        ))
+
+    def _group_by_python(self, keys, bucket, billable_only):
+        columns = self._columns
+
+        if billable_only:
+            mask = [bool(flag) for flag in columns["billable"]]
+        else:
+            mask = [True] * len(self)
+
+        key_columns = [[value for value, selected in zip(columns[key], mask) if selected] for key in keys]
+        if bucket is not None:
+            key_columns.append(self._bucket_days(bucket, mask))
+
+        times = [value for value, selected in zip(columns["time"], mask) if selected]
+        amounts = [value for value, selected in zip(columns["amount"], mask) if selected]
+
+        sums = {}
+        for ids, time, amount in zip(zip(*key_columns) if key_columns else [()] * len(times), times, amounts):
+            total = sums.setdefault(ids, [0, 0.0])
+            total[0] += time
+            total[1] += amount
+
+        return [(ids, total[0], total[1]) for ids, total in sums.items()]
+
+    def rollup(self, keys, bucket=None, billable_only=False):
+        """Compute group totals and subtotals for all prefixes of ``keys`` (like SQL's ``GROUP BY ROLLUP``).
+
+        :param keys: Columns to group by, see :const:`KEY_COLUMNS`.
+        :type keys: collections.abc.Sequence[str]
+        :param bucket: See :meth:`group_by`.
+        :type bucket: str | None
+        :param billable_only: See :meth:`group_by`.
+        :type billable_only: bool
+        :return: Same as :meth:`group_by`, but including subtotal rows. In subtotal rows, the key values of the
+            columns which have been rolled up are ``None``. The last row is the grand total.
+        :rtype: list[(tuple, int, float)]
+        """
+        result = []
+
+        for length in range(len(keys), -1, -1):
+            padding = (None,) * (len(keys) - length)
+
+            for key, time, amount in self.group_by(keys[:length], bucket, billable_only):
+                if bucket is not None:
+                    key = key[:-1] + padding + key[-1:]
+                else:
+                    key += padding
+
+                result.append((key, time, amount))
+
+        return result
+
+
+def load_file(table, path, require_dates=False):
+    """Load report data from a JSON file into a table.
+
+    The file can either contain a summary report (requested using :const:`.report.SUMMARY_PARAMS`), a detailed
+    report or a snapshot (see :mod:`.snapshot`). If a summary report contains a top-level ``since`` key, then its
+    records are assigned to that date; snapshot records are assigned to the first day of the snapshot period.
+
+    Summary reports as returned by the API (and written by ``toggl-fetch --format json``) do not contain a ``since``
+    key, so their records have no date.
+
+    :param table: Table to add the data to.
+    :type table: EntryTable
+    :param path: Path of the file to load.
+    :type path: str
+    :param require_dates: Refuse to load records without a date (e. g. for grouping by date).
+    :type require_dates: bool
+    :return: Nothing.
+    :rtype: None
+    :raises OSError: If the file cannot be read.
+    :raises ValueError: If the file does not contain a valid report (this includes JSON decoding errors), or if
+        ``require_dates`` is set and the report has no dates.
+    """
+    with open(path, "r", encoding="utf-8") as fh:
+        data = json.load(fh)
+
+    if isinstance(data, dict) and isinstance(data.get("rows"), list):
+        table.add_snapshot(data)
+        return
+
+    if not isinstance(data, dict) or not isinstance(data.get("data"), list):
+        raise ValueError("Not a report")
+
+    if any("dur" in entry for entry in data["data"]):
+        table.add_details(data)
+    elif data.get("since"):
+        table.add_summary(data, dateutil.parser.parse(data["since"]).date())
+    elif require_dates:
+        raise ValueError("Summary report without dates, cannot group it by date (use a snapshot or a detailed report)")
+    else:
+        table.add_summary(data)
+
+
+def get_argparser():
+    """Get the argument parser for the aggregation frontend.
+
+    :return: Argument parser.
+    :rtype: argparse.ArgumentParser
+    """
+    argparser = ArgumentParser(
+            description="Aggregate saved Toggl.com report data (JSON summary or detailed reports, snapshots) locally"
+    )
+
+    argparser.add_argument(
+            "-V",
+            "--version",
+            action="version",
+            version="%%(prog)s %s" % app_version.version,
+            help="Display the program version and exit."
+    )
+    argparser.add_argument(
+            "files",
+            nargs="+",
+            metavar="FILE",
+            help="JSON report file to load."
+    )
+    argparser.add_argument(
+            "-g",
+            "--group-by",
+            default="project",
+            help="Comma-separated list of columns to group by. Valid columns: %s. Default: `%%(default)s'"
+                 % ", ".join(KEY_COLUMNS)
+    )
+    argparser.add_argument(
+            "-b",
+            "--bucket",
+            choices=BUCKETS,
+            help="Additionally group by date. Not possible for summary reports, which contain no dates."
+    )
+    argparser.add_argument(
+            "-r",
+            "--rollup",
+            action="store_true",
+            help="Include subtotals and a grand total."
+    )
+    argparser.add_argument(
+            "--billable-only",
+            action="store_true",
+            help="Only include billable time."
+    )
+
+    return argparser
+
+
+def main():
+    """Main method for the aggregation frontend.
+
+    Writes the aggregated data as CSV to standard output.
+
+    :return: A status code:
+
+        * 0: OK, no errors
+        * 1: Invalid command line arguments
+        * 4: Cannot load a report file
+    :rtype: int
+    """
+    logging.basicConfig()
+    args = get_argparser().parse_args()
+
+    keys = [key.strip() for key in args.group_by.split(",") if key.strip()]
+    invalid_keys = set(keys) - set(KEY_COLUMNS)
+    if invalid_keys:
+        logging.error("Cannot group by: %s", ", ".join(sorted(invalid_keys)))
+        return 1
+
+    table = EntryTable()
+    for path in args.files:
+        try:
+            load_file(table, path, require_dates=args.bucket is not None)
+        except (OSError, ValueError, OverflowError) as e:
+            logging.error("Cannot load report file `%s': %s", path, e)
+            return 4
+
+    if args.rollup:
+        groups = table.rollup(keys, args.bucket, args.billable_only)
+    else:
+        groups = table.group_by(keys, args.bucket, args.billable_only)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(keys + ([args.bucket] if args.bucket else []) + ["hours", "amount"])
+
+    for key, time, amount in groups:
+        writer.writerow([
+            "" if value is None else value.isoformat() if isinstance(value, datetime.date) else value
+            for value in key
+        ] + ["%.2f" % (time / 3600000), "%.2f" % amount])
+
+    return 0
@@ -18,8 +18,15 @@ You should have received a copy of the GNU General Public License
 along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
 """
 
+import collections
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
 import json
 import logging
+import math
+import threading
 import time
 from abc import *
 
@@ -27,6 +34,7 @@ import requests
 import requests.exceptions
 
 from . import app_version
+from . import transport
 
 
 # User agent to use for API requests
@@ -38,6 +46,17 @@ _logger = logging.getLogger(__name__)
 # Session cache. See _get_session().
 _sessions = {}
 
+# Transport cache. See _get_transport().
+_transports = {}
+_transports_lock = threading.Lock()
+
+# Rate limiter cache. See _get_rate_limiter().
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+# Deadline and priority of the API requests made by the current thread. See request_urgency().
+_urgency = threading.local()
+
 
 def _get_session(auth):
     """Retrieve a possibly cached requests session for the specified Toggl.com user credentials.
@@ -74,6 +93,256 @@ def _get_session(auth):
     return _sessions[auth]
 
 
+def _get_transport(auth, name):
+    """Retrieve a possibly cached transport (see :mod:`.transport`) for the specified Toggl.com user credentials.
+
+    Like sessions (see :func:`_get_session`), transports are shared so that all API clients using the same credentials
+    share connections.
+
+    :param auth: Toggl.com user credentials, see :func:`_get_session`.
+    :type auth: (str, str)
+    :param name: Name of the transport backend, see :const:`.transport.TRANSPORTS`.
+    :type name: str
+    :return: Transport object using the specified credentials.
+    :rtype: transport.Transport
+    :raises APIError: If the transport backend does not exist or cannot be used.
+    """
+    if name not in transport.TRANSPORTS:
+        raise APIError("Unknown transport backend: %s" % name)
+
+    with _transports_lock:
+        if (auth, name) not in _transports:
+            _logger.debug("Creating new %s transport for auth %s", name, auth)
+
+            try:
+                if name == "requests":
+                    # The requests transport uses our (customized) session.
+                    _transports[(auth, name)] = transport.RequestsTransport(auth, USER_AGENT, _get_session(auth))
+                else:
+                    _transports[(auth, name)] = transport.TRANSPORTS[name](auth, USER_AGENT)
+            except transport.TransportUnavailableError as e:
+                raise APIError(str(e)) from e
+
+        return _transports[(auth, name)]
+
+
+def _get_rate_limiter(auth):
+    """Retrieve the (shared) rate limiter for the specified Toggl.com user credentials.
+
+    Toggl.com limits the request rate per API token, so all API clients using the same credentials need to share a
+    single rate limiter.
+
+    :param auth: Toggl.com user credentials, see :func:`_get_session`.
+    :type auth: (str, str)
+    :return: Rate limiter for the specified credentials.
+    :rtype: RateLimiter
+    """
+    with _rate_limiters_lock:
+        if auth not in _rate_limiters:
+            _rate_limiters[auth] = RateLimiter()
+
+        return _rate_limiters[auth]
+
+
+def _get_urgency():
+    """Get the deadline, priority and cancel event of the requests made by the current thread, see
+    :func:`request_urgency`.
+
+    :rtype: (float, int, threading.Event | None)
+    """
+    return getattr(_urgency, "value", None) or (math.inf, 0, None)
+
+
+@contextlib.contextmanager
+def request_urgency(deadline, priority=0, cancel=None):
+    """Context manager giving the API requests made by the current thread a deadline and a priority.
+
+    When several threads wait for the rate limit, requests with an earlier deadline (and, among those with the same
+    deadline, a higher priority) are made first, see :meth:`RateLimiter.acquire`. Requests without a deadline come last.
+
+    :param deadline: Time (UNIX timestamp) by which the requests must have been made.
+    :type deadline: float
+    :param priority: Priority of the requests.
+    :type priority: int
+    :param cancel: If given, then requests which have not been sent yet fail with :exc:`RequestCancelledError` once
+        this event is set (e. g. because the deadline has passed), instead of using up the rate limit.
+    :type cancel: threading.Event | None
+    """
+    previous = getattr(_urgency, "value", None)
+    _urgency.value = (deadline, priority, cancel)
+
+    try:
+        yield
+    finally:
+        _urgency.value = previous
+
+
+def bind_request_urgency(func):
+    """Wrap a function so that it makes its API requests with the deadline, priority and cancel event of the current
+    thread.
+
+    Use this when handing work to another thread, see :func:`request_urgency`.
+
+    :param func: The function to wrap.
+    :type func: callable
+    :return: The wrapped function.
+    :rtype: callable
+    """
+    urgency = getattr(_urgency, "value", None)
+    if urgency is None:
+        return func
+
+    def wrapper(*args, **kwargs):
+        with request_urgency(*urgency):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+class RateLimiter:
+    """A thread-safe token bucket used to keep API requests below the Toggl.com rate limit of 1 req/s.
+
+    Threads waiting for a token are served in order of the deadlines and priorities of their requests (see
+    :func:`request_urgency`), and in the order in which they started waiting otherwise.
+    """
+
+    # Maximum time (in seconds) a thread whose requests can be cancelled waits before checking its cancel event
+    CANCEL_POLL_INTERVAL = 0.1
+
+    def __init__(self, rate=1.0, capacity=1):
+        """Create a new rate limiter.
+
+        :param rate: Number of requests allowed per second (on average).
+        :type rate: float
+        :param capacity: Maximum number of requests which may be made in a burst.
+        :type capacity: int
+        """
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._waiters = []
+        self._counter = itertools.count()
+
+    def _refill(self):
+        """Add the tokens accumulated since the last refill. Must be called with the lock held."""
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+    def try_acquire(self):
+        """Take a token from the bucket if one is available and no other thread is waiting for one, without blocking.
+
+        :return: ``True`` if a token was taken (i. e. a request may be made now), ``False`` otherwise.
+        :rtype: bool
+        """
+        with self._lock:
+            self._refill()
+
+            if self._tokens >= 1 and not self._waiters:
+                self._tokens -= 1
+                return True
+
+            return False
+
+    def acquire(self):
+        """Take a token from the bucket, waiting until one becomes available and it is the current thread's turn.
+
+        :return: Nothing.
+        :rtype: None
+        :raises RequestCancelledError: If the requests of the current thread have been cancelled (see
+            :func:`request_urgency`). No token is taken in this case.
+        """
+        deadline, priority, cancel = _get_urgency()
+        # The counter keeps the order stable for waiters with equal deadlines and priorities.
+        waiter = (deadline, -priority, next(self._counter))
+
+        with self._cond:
+            heapq.heappush(self._waiters, waiter)
+
+            try:
+                while True:
+                    if cancel is not None and cancel.is_set():
+                        # Don't use up a token (and block the other waiters) for a request nobody waits for anymore.
+                        raise RequestCancelledError("Request cancelled")
+
+                    self._refill()
+
+                    if self._waiters[0] != waiter:
+                        # Not our turn; we are notified when the first waiter has got its token.
+                        timeout = None
+                    elif self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    else:
+                        timeout = (1 - self._tokens) / self._rate
+
+                    if cancel is not None:
+                        timeout = min(timeout or self.CANCEL_POLL_INTERVAL, self.CANCEL_POLL_INTERVAL)
+
+                    self._cond.wait(timeout)
+            finally:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+
+                # Let the next waiter check whether it's its turn now.
+                self._cond.notify_all()
+
+
+class _LatencyWindow:
+    """Keeps the latencies of the most recent requests and computes percentiles over them."""
+    def __init__(self, size):
+        """Create a new latency window.
+
+        :param size: Number of latency samples to keep.
+        :type size: int
+        """
+        self._samples = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def samples(self):
+        """Get the recorded samples, oldest first.
+
+        :return: Latency samples in seconds.
+        :rtype: list[float]
+        """
+        with self._lock:
+            return list(self._samples)
+
+    def add(self, latency):
+        """Record the latency of a completed request.
+
+        :param latency: Request latency in seconds.
+        :type latency: float
+        :return: Nothing.
+        :rtype: None
+        """
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, percentile):
+        """Compute a latency percentile (nearest-rank method) over the recorded samples.
+
+        :param percentile: Percentile to compute, between 0 and 100.
+        :type percentile: float
+        :return: The latency percentile in seconds, or ``None`` if no samples have been recorded yet.
+        :rtype: float | None
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+
+        if not samples:
+            return None
+
+        rank = max(1, math.ceil(percentile / 100 * len(samples)))
+        return samples[rank - 1]
+
+
 class APIError(Exception):
     """Base class for all exceptions explicitly raised by this module. Also raised for general API errors."""
     def __init__(self, message):
@@ -97,12 +366,17 @@ class RateLimitingError(APIError):
     pass
 
 
+class RequestCancelledError(APIError):
+    """Raised if a request is cancelled before it has been sent, see :func:`request_urgency`."""
+    pass
+
+
 class _APIBase(metaclass=ABCMeta):
     """Provides basic functionality for Toggl.com API client classes.
 
     Not intended for direct use. Extend this class to implement a client for a specific Toggl API.
     """
-    def __init__(self, api_base_url, api_token):
+    def __init__(self, api_base_url, api_token, transport_name="requests"):
         """Create a new **generic** Toggl API client.
 
         Do not call this directly. This constructor is intended to be called by child classes (which implement a
@@ -112,9 +386,29 @@ class _APIBase(metaclass=ABCMeta):
         :type api_base_url: str
         :param api_token: API token used for authentication.
         :type api_token: str
+        :param transport_name: Name of the HTTP transport backend to use, see :const:`.transport.TRANSPORTS`.
+        :type transport_name: str
+        :raises APIError: If the transport backend does not exist or cannot be used.
         """
         self._api_base_url = api_base_url
-        self._session = _get_session((api_token, "api_token"))
+        self._transport = _get_transport((api_token, "api_token"), transport_name)
+        self._rate_limiter = _get_rate_limiter((api_token, "api_token"))
+
+    def _send_get(self, url, params):
+        """Send a single HTTP GET request, without any error checking or retrying.
+
+        Child classes may override this to change how requests are sent. The caller has already taken a token from
+        the rate limiter for this request.
+
+        :param url: Full URL to request.
+        :type url: str
+        :param params: Query string parameters.
+        :type params: dict
+        :return: HTTP response object.
+        :rtype: requests.models.Response | transport.TransportResponse
+        :raises requests.exceptions.RequestException: If an HTTP-related error occurs.
+        """
+        return self._transport.get(url, params)
 
     def _do_get(self, path, attempts=3, decode_json=True, **params):
         """Perform a HTTP GET request.
@@ -144,8 +438,9 @@ class _APIBase(metaclass=ABCMeta):
         """
         for attempt in range(1, attempts + 1):
             try:
-                # Perform the GET request
-                resp = self._session.get(self._api_base_url + path, params=params)
+                # Perform the GET request, staying within the rate limit
+                self._rate_limiter.acquire()
+                resp = self._send_get(self._api_base_url + path, params)
 
                 # This will throw an exception (caught below) if the response has errors.
                 self._check_error(resp)
@@ -161,8 +456,13 @@ class _APIBase(metaclass=ABCMeta):
                     # Tried and failed <attempts> times, give up.
                     raise
 
-                # Wait 1 sec before retrying
-                time.sleep(1)
+                # Wait 1 sec before retrying. If the request is cancelled in the meantime, then acquiring a token
+                # fails right away.
+                cancel = _get_urgency()[2]
+                if cancel is not None:
+                    cancel.wait(1)
+                else:
+                    time.sleep(1)
 
     @abstractmethod
     def _check_error(self, response):
@@ -171,7 +471,7 @@ class _APIBase(metaclass=ABCMeta):
         Should raise an exception if the response has errors and do nothing if the response denotes a success.
 
         :param response: HTTP response object
-        :type response: requests.models.Response
+        :type response: requests.models.Response | transport.TransportResponse
         :return: Nothing.
         :rtype: None
         """
@@ -189,14 +489,17 @@ class Toggl(_APIBase):
     # The base URL of the Toggl.com API
     API_BASE_URL = "https://www.toggl.com/api/v8/"
 
-    def __init__(self, api_token):
+    def __init__(self, api_token, transport_name="requests"):
         """
         Create a new client for the Toggl API, version 8.
 
         :param api_token: API token to use for authentication.
         :type api_token: str
+        :param transport_name: Name of the HTTP transport backend to use, see :const:`.transport.TRANSPORTS`.
+        :type transport_name: str
+        :raises .APIError: If the transport backend does not exist or cannot be used.
         """
-        super().__init__(self.API_BASE_URL, api_token)
+        super().__init__(self.API_BASE_URL, api_token, transport_name)
 
     def _check_error(self, response):
         """
@@ -208,7 +511,7 @@ class Toggl(_APIBase):
           - Error 403: https://github.com/toggl/toggl_api_docs/blob/master/toggl_api.md#authentication
 
         :param response: HTTP response
-        :type response: requests.models.Response
+        :type response: requests.models.Response | transport.TransportResponse
         :raises .APIError: If a generic API error occurs. The string representation of the exception will include
             human-readable details about the error.
         :raises .AuthenticationError: Invalid API token supplied.
@@ -253,7 +556,7 @@ class Toggl(_APIBase):
         # Not found
         return None
 
-    def get_user_info(self):
+    def get_user_info(self, since=None):
         """Get extended user information (for the currently logged in user).
 
         See :meth:`_do_get` for details on raised exceptions.
@@ -265,9 +568,19 @@ class Toggl(_APIBase):
             which the user can see", as described here:
             https://github.com/toggl/toggl_api_docs/blob/master/chapters/users.md#get-current-user-data
 
+          - If ``since`` is given, then the related data only includes objects which have been changed (or deleted)
+            since then, as described here:
+            https://github.com/toggl/toggl_api_docs/blob/master/chapters/users.md#get-current-user-data
+            The returned data includes a ``since`` timestamp which can be used for the next request.
+
+        :param since: UNIX timestamp. If given, then only related data changed since then is returned.
+        :type since: int | None
         :return: User data, as described above.
         :rtype: dict
         """
+        if since is not None:
+            return self._do_get("me", with_related_data="true", since=since)
+
         return self._do_get("me", with_related_data="true")
 
 
@@ -280,14 +593,184 @@ class TogglReports(_APIBase):
     # Base URL for the Toggl.com reports API
     API_BASE_URL = "https://www.toggl.com/reports/api/v2/"
 
-    def __init__(self, api_token):
+    # Number of recent request latencies (per URL) used to determine the hedging threshold
+    HEDGE_WINDOW_SIZE = 50
+
+    def __init__(self, api_token, transport_name="requests", hedge=False, hedge_percentile=95, hedge_min_samples=10,
+                 hedge_min_delay=1.0):
         """
         Create a new client for the Toggl reports API, version 2.
 
+        If hedging is enabled, then a request which takes longer than the ``hedge_percentile`` latency percentile of
+        the recent requests to the same URL is sent a second time (if the rate limit allows for it). The response
+        which arrives first is used, the other one is discarded. See :attr:`hedge_stats` for hedging metrics.
+
         :param api_token: API token to use for authentication.
         :type api_token: str
+        :param transport_name: Name of the HTTP transport backend to use, see :const:`.transport.TRANSPORTS`.
+        :type transport_name: str
+        :param hedge: Whether to send hedged requests.
+        :type hedge: bool
+        :param hedge_percentile: Latency percentile after which a hedged request is sent.
+        :type hedge_percentile: float
+        :param hedge_min_samples: Number of latency samples needed for a URL before requests to it are hedged.
+        :type hedge_min_samples: int
+        :param hedge_min_delay: Minimum time (in seconds) to wait for a response before sending a hedged request.
+        :type hedge_min_delay: float
+        :raises .APIError: If the transport backend does not exist or cannot be used.
         """
-        super().__init__(self.API_BASE_URL, api_token)
+        super().__init__(self.API_BASE_URL, api_token, transport_name)
+
+        self._hedge = hedge
+        self._hedge_percentile = hedge_percentile
+        self._hedge_min_samples = hedge_min_samples
+        self._hedge_min_delay = hedge_min_delay
+        self._latencies = collections.defaultdict(lambda: _LatencyWindow(self.HEDGE_WINDOW_SIZE))
+        self._hedge_stats = collections.Counter()
+        self._hedge_stats_lock = threading.Lock()
+
+    @property
+    def hedge_stats(self):
+        """Hedging metrics for this client.
+
+        The returned ``dict`` has the following keys:
+
+        - ``requests``: Number of requests sent with hedging enabled (not counting hedged duplicates).
+        - ``hedged``: Number of requests for which a hedged duplicate was sent.
+        - ``hedge_won``: Number of requests where the response to the hedged duplicate arrived first.
+        - ``hedge_skipped``: Number of requests which should have been hedged, but the rate limit did not allow it.
+
+        :rtype: dict
+        """
+        with self._hedge_stats_lock:
+            return {key: self._hedge_stats[key] for key in ("requests", "hedged", "hedge_won", "hedge_skipped")}
+
+    def get_latency_samples(self):
+        """Get the recorded request latencies used to determine the hedging threshold.
+
+        Callers can persist these and pass them to :meth:`add_latency_samples` in a later process, so that the
+        hedging threshold does not have to be learned from scratch each time.
+
+        :return: Latency samples in seconds (oldest first), by URL.
+        :rtype: dict[str, list[float]]
+        """
+        return {url: window.samples() for url, window in self._latencies.items() if len(window)}
+
+    def add_latency_samples(self, samples):
+        """Add previously recorded request latencies, see :meth:`get_latency_samples`.
+
+        :param samples: Latency samples in seconds (oldest first), by URL.
+        :type samples: dict[str, list[float]]
+        :return: Nothing.
+        :rtype: None
+        """
+        for url, latencies in samples.items():
+            for latency in latencies:
+                self._latencies[url].add(latency)
+
+    def _count(self, key):
+        """Increment a hedging metric. See :attr:`hedge_stats`."""
+        with self._hedge_stats_lock:
+            self._hedge_stats[key] += 1
+
+    def _timed_send_get(self, url, params):
+        """Send a GET request and return the response together with the request latency (in seconds)."""
+        start = time.monotonic()
+        resp = super()._send_get(url, params)
+
+        return resp, time.monotonic() - start
+
+    def _submit_send_get(self, url, params):
+        """Send a GET request in a new daemon thread, see :meth:`_timed_send_get`.
+
+        Daemon threads are used so that a request whose response is not needed anymore (because the other request of a
+        hedged pair won) cannot delay the exit of the program.
+
+        :return: Future for the response and the request latency.
+        :rtype: concurrent.futures.Future
+        """
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+
+        def send():
+            try:
+                future.set_result(self._timed_send_get(url, params))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=send, daemon=True).start()
+
+        return future
+
+    @staticmethod
+    def _discard_response(future):
+        """Done callback for requests whose response is not needed anymore: Releases the connection."""
+        if not future.cancelled() and future.exception() is None:
+            future.result()[0].close()
+
+    def _send_get(self, url, params):
+        """Send a GET request, hedging it if hedging is enabled.
+
+        See :meth:`_APIBase._send_get`.
+        """
+        if not self._hedge:
+            return super()._send_get(url, params)
+
+        self._count("requests")
+
+        latencies = self._latencies[url]
+        threshold = None
+        if len(latencies) >= self._hedge_min_samples:
+            threshold = max(latencies.percentile(self._hedge_percentile), self._hedge_min_delay)
+
+        primary_start = time.monotonic()
+        primary = self._submit_send_get(url, params)
+        pending = {primary}
+
+        if threshold is not None:
+            done, pending = concurrent.futures.wait(pending, timeout=threshold)
+
+            if not done:
+                # Primary request is slow -- send a duplicate, but only if that doesn't exceed the rate limit.
+                if self._rate_limiter.try_acquire():
+                    _logger.debug("No response after %.2f s, sending hedged request for URL %s", threshold, url)
+                    self._count("hedged")
+                    pending.add(self._submit_send_get(url, params))
+                else:
+                    _logger.debug("Not hedging request for URL %s: Rate limit reached", url)
+                    self._count("hedge_skipped")
+
+        # Use the first successful response. If all requests fail, re-raise the error of the primary request.
+        winner = None
+        while pending and winner is None:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None and winner is None:
+                    winner = future
+                else:
+                    self._discard_response(future)
+
+        for future in pending:
+            # Requests cannot be aborted once they are running; make sure the connection is released at least (unless
+            # the program exits first).
+            future.add_done_callback(self._discard_response)
+
+        if winner is None:
+            return primary.result()[0]
+
+        resp, latency = winner.result()
+
+        if winner is not primary:
+            self._count("hedge_won")
+
+            # Record how long the primary request has taken so far (at least the threshold) instead of the latency of
+            # the hedged request; otherwise, slow requests would never be recorded and the threshold would drift down.
+            latency = time.monotonic() - primary_start
+
+        latencies.add(latency)
+
+        return resp
 
     def _check_error(self, response, log_warnings=True):
         """
@@ -299,7 +782,7 @@ class TogglReports(_APIBase):
             https://github.com/toggl/toggl_api_docs/blob/master/reports.md#failed-requests
 
         :param response: HTTP response
-        :type response: requests.models.Response
+        :type response: requests.models.Response | transport.TransportResponse
         :param log_warnings: If ``True``, then log the contents of ``Warning`` headers in the response with log level
             WARNING.
         :type log_warnings: bool
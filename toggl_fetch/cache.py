@@ -0,0 +1,298 @@
+"""Provides a file-based cache for Toggl.com API responses.
+
+This file is part of toggl-fetch, see https://github.com/Tblue/toggl-fetch.
+
+Copyright 2016  Tilman Blumenbach
+
+toggl-fetch is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+toggl-fetch is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import os.path
+import threading
+import time
+
+
+# The logger used by this module
+_logger = logging.getLogger(__name__)
+
+
+CacheEntry = collections.namedtuple("CacheEntry", ("data", "age"))
+CacheEntry.__doc__ = """A cached value (``bytes``) together with its age in seconds."""
+
+
+class ResponseCache:
+    """Stores API responses as files in a directory. Each entry is identified by a key (any JSON-serializable value).
+
+    Cache files may contain sensitive data, so they are only readable by the current user.
+    """
+    def __init__(self, path):
+        """Create a new cache object.
+
+        :param path: Cache directory. It is created if it does not exist.
+        :type path: str
+        :raises OSError: If the cache directory cannot be created.
+        """
+        self._path = path
+
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    def _file(self, key):
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+        return os.path.join(self._path, digest + ".cache")
+
+    def get(self, key):
+        """Retrieve a cache entry.
+
+        :param key: Key of the entry.
+        :type key: object
+        :return: The cache entry or ``None`` if there is no entry for the key.
+        :rtype: CacheEntry | None
+        :raises OSError: If the cache file exists, but cannot be read.
+        """
+        path = self._file(key)
+
+        try:
+            with open(path, "rb") as fh:
+                age = time.time() - os.fstat(fh.fileno()).st_mtime
+                return CacheEntry(fh.read(), max(age, 0))
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        """Store a cache entry (atomically), replacing an existing entry with the same key.
+
+        :param key: Key of the entry.
+        :type key: object
+        :param data: Data to store.
+        :type data: bytes
+        :return: Nothing.
+        :rtype: None
+        :raises OSError: If the cache file cannot be written.
+        """
+        path = self._file(key)
+        tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+
+        os.replace(tmp_path, path)
+
+    def prune(self, max_age):
+        """Remove all cache entries (and leftover temporary files) which are older than the given age.
+
+        :param max_age: Maximum age of the entries to keep, in seconds.
+        :type max_age: float
+        :return: The number of removed files.
+        :rtype: int
+        :raises OSError: If the cache directory cannot be read.
+        """
+        cutoff = time.time() - max_age
+        removed = 0
+
+        for entry in os.scandir(self._path):
+            if not entry.name.endswith((".cache", ".tmp")):
+                continue
+
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                # Removed or replaced by another process in the meantime.
+                pass
+
+        return removed
+
+
+def _auth_key(api_token):
+    """Derive a cache key component from an API token, so that the token itself is not stored anywhere."""
+    return hashlib.sha256(api_token.encode("utf-8")).hexdigest()
+
+
+class _Revalidator:
+    """Shared logic for API wrappers serving cached responses."""
+    def __init__(self, cache, max_age):
+        self._cache = cache
+        self._max_age = max_age
+
+    def _get_cached(self, key):
+        """Get a cache entry, treating unreadable entries as missing."""
+        try:
+            return self._cache.get(key)
+        except OSError as e:
+            _logger.warning("Cannot read cache entry: %s", e)
+            return None
+
+    def _store(self, key, data):
+        """Store a cache entry, logging (and otherwise ignoring) errors."""
+        try:
+            self._cache.put(key, data)
+        except OSError as e:
+            _logger.warning("Cannot write cache entry: %s", e)
+
+    def _refresh_in_background(self, key, fetch, encode):
+        """Fetch a fresh value in a background thread and store it in the cache.
+
+        The thread is a daemon thread, so the program does not wait for the refresh before exiting. If the refresh has
+        not finished by then, the entry stays stale and is refreshed by the next invocation (or by ``--prefetch``).
+        """
+        def refresh():
+            try:
+                self._store(key, encode(fetch()))
+                _logger.debug("Refreshed cache entry in the background")
+            except Exception as e:
+                _logger.warning("Cannot refresh cache entry in the background: %s", e)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+class CachedToggl(_Revalidator):
+    """Wraps a :class:`.api.Toggl` client, serving user information from a cache using stale-while-revalidate.
+
+    Fresh cached user information (not older than ``max_age`` seconds) is returned right away. Stale cached user
+    information is returned right away as well, but refreshed in the background (while the program is running) for the
+    next invocation. Only if there is no cached user information at all, the API is queried synchronously.
+
+    All other attributes are passed through to the wrapped client.
+    """
+    def __init__(self, toggl_api, api_token, cache, max_age):
+        """Create a new caching wrapper.
+
+        :param toggl_api: Client to wrap.
+        :type toggl_api: api.Toggl
+        :param api_token: API token used by the client (only a hash of it is used as part of the cache key).
+        :type api_token: str
+        :param cache: Cache to use.
+        :type cache: ResponseCache
+        :param max_age: Age (in seconds) up to which a cache entry is considered fresh.
+        :type max_age: float
+        """
+        super().__init__(cache, max_age)
+
+        self._toggl_api = toggl_api
+        self._auth_key = _auth_key(api_token)
+
+    def __getattr__(self, name):
+        return getattr(self._toggl_api, name)
+
+    def get_user_info(self, since=None):
+        """Get extended user information, possibly from the cache. See :meth:`.api.Toggl.get_user_info`.
+
+        Only complete user information is cached; requests using ``since`` are passed through to the API.
+        """
+        if since is not None:
+            return self._toggl_api.get_user_info(since=since)
+
+        key = ["user_info", self._auth_key]
+        entry = self._get_cached(key)
+
+        if entry is not None:
+            try:
+                user_info = json.loads(entry.data.decode("utf-8"))
+            except ValueError:
+                _logger.warning("Ignoring corrupt cached user information")
+            else:
+                if entry.age > self._max_age:
+                    _logger.debug("Using stale cached user information (%.0f s old), refreshing it", entry.age)
+                    self._refresh_in_background(key, self._toggl_api.get_user_info, _encode_json)
+                else:
+                    _logger.debug("Using cached user information (%.0f s old)", entry.age)
+
+                return user_info
+
+        return self.prefetch_user_info()
+
+    def prefetch_user_info(self):
+        """Get extended user information from the API (bypassing the cache) and cache it.
+
+        :return: User information, see :meth:`.api.Toggl.get_user_info`.
+        :rtype: dict
+        """
+        user_info = self._toggl_api.get_user_info()
+        self._store(["user_info", self._auth_key], _encode_json(user_info))
+
+        return user_info
+
+
+class CachedTogglReports(_Revalidator):
+    """Wraps a :class:`.api.TogglReports` client, serving summary reports from a cache.
+
+    Cached reports are only returned if they are fresh (not older than ``max_age`` seconds): Unlike user information,
+    a stale report would end up in the output. Reports which are not cached or stale are fetched synchronously and
+    then cached.
+
+    Reports are cached by all of their parameters, including the start and end dates: A cached report is only used for
+    exactly the same period.
+
+    All other attributes are passed through to the wrapped client.
+    """
+    def __init__(self, toggl_reports, api_token, cache, max_age):
+        """Create a new caching wrapper.
+
+        :param toggl_reports: Client to wrap.
+        :type toggl_reports: api.TogglReports
+        :param api_token: API token used by the client (only a hash of it is used as part of the cache key).
+        :type api_token: str
+        :param cache: Cache to use.
+        :type cache: ResponseCache
+        :param max_age: Age (in seconds) up to which a cache entry is considered fresh.
+        :type max_age: float
+        """
+        super().__init__(cache, max_age)
+
+        self._toggl_reports = toggl_reports
+        self._auth_key = _auth_key(api_token)
+
+    def __getattr__(self, name):
+        return getattr(self._toggl_reports, name)
+
+    def _summary_key(self, as_pdf, params):
+        return ["summary", self._auth_key, as_pdf, {name: str(value) for name, value in params.items()}]
+
+    def get_summary(self, as_pdf=False, **params):
+        """Retrieve a summary report, possibly from the cache. See :meth:`.api.TogglReports.get_summary`."""
+        entry = self._get_cached(self._summary_key(as_pdf, params))
+
+        if entry is not None and entry.age <= self._max_age:
+            _logger.info("Using cached report (%.0f s old)", entry.age)
+
+            if as_pdf:
+                return entry.data
+
+            try:
+                return json.loads(entry.data.decode("utf-8"))
+            except ValueError:
+                _logger.warning("Ignoring corrupt cached report")
+
+        return self.prefetch_summary(as_pdf, **params)
+
+    def prefetch_summary(self, as_pdf=False, **params):
+        """Retrieve a summary report from the API (bypassing the cache) and cache it.
+
+        See :meth:`.api.TogglReports.get_summary` for the parameters and the return value.
+        """
+        summary = self._toggl_reports.get_summary(as_pdf=as_pdf, **params)
+        self._store(self._summary_key(as_pdf, params), summary if as_pdf else _encode_json(summary))
+
+        return summary
+
+
+def _encode_json(data):
+    return json.dumps(data).encode("utf-8")
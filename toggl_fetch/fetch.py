@@ -18,13 +18,20 @@ You should have received a copy of the GNU General Public License
 along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
 """
 
+import collections
+import concurrent.futures
 import configparser
 import datetime
+import functools
+import hashlib
 import json
 import logging
 import os.path
 import re
-from argparse import ArgumentParser, ArgumentTypeError
+import sys
+import threading
+import time
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
 
 import dateutil.parser
 import dateutil.tz
@@ -33,6 +40,13 @@ from xdg import BaseDirectory
 
 from . import api
 from . import app_version
+from . import cache
+from . import index
+from . import jobs
+from . import report
+from . import shard
+from . import snapshot
+from . import transport
 
 
 # Short name of this application. Used in file systems paths for configuration file loading etc. (paths conform to the
@@ -46,6 +60,45 @@ CONFIG_FILENAME = "config.ini"
 # This file is located in the XDG data directory for this application.
 END_DATES_FILENAME = "end_dates.json"
 
+# Name of the directory containing snapshots of fetched JSON summary reports (see the snapshot module). This directory
+# is located in the XDG data directory for this application.
+SNAPSHOTS_DIRNAME = "snapshots"
+
+# Name of the file storing the index of workspace, project, client and tag names (see the index module), with a
+# placeholder for a hash of the API token (so that different accounts use different indexes). This file is located in
+# the XDG data directory for this application.
+INDEX_FILENAME = "index_%s.json"
+
+# Name of the file storing the latencies of recent report requests, used to determine when to send hedged requests (see
+# --hedge). This file is located in the XDG data directory for this application.
+LATENCIES_FILENAME = "latencies.json"
+
+# Cached API responses (see --max-cache-age and --prefetch) which are older than this many seconds are removed. This
+# is far longer than any sensible --max-cache-age, since stale user information is still used (and refreshed).
+CACHE_PRUNE_AGE = 7 * 24 * 3600
+
+# Report filters (see --project, --client and --tag): Kind of object (see the index module), mapped to the name of the
+# report parameter.
+FILTER_PARAMS = collections.OrderedDict((
+    ("projects", "project_ids"),
+    ("clients", "client_ids"),
+    ("tags", "tag_ids"),
+))
+
+# Supported output formats (see --format), mapped to the name of the argument holding the output file template.
+OUTPUT_FORMATS = {
+    "pdf": "output",
+    "json": "json_output",
+    "csv": "csv_output",
+}
+
+# Settings which can be overridden per job in a --jobs file (see parse_job()), named like the corresponding command line
+# arguments.
+JOB_OPTIONS = ("start_date", "end_date", "project", "client", "tag", "format", "output", "json_output", "csv_output")
+
+# Serializes updates of the end dates file when several reports are fetched concurrently (see --jobs).
+_end_dates_lock = threading.Lock()
+
 
 def parse_date(string):
     """Type handler for argparse: Parses a date from a string using :func:`dateutil.parser.parse`.
@@ -70,6 +123,49 @@ def parse_date(string):
     return date
 
 
+def parse_shard(string):
+    """Type handler for argparse: Parses a shard specification of the form ``INDEX/COUNT`` (e. g. ``0/3``).
+
+    :param string: Shard specification to parse.
+    :type string: str
+    :return: Tuple of (worker index, worker count).
+    :rtype: (int, int)
+    :raises argparse.ArgumentTypeError: If the input string is not a valid shard specification.
+    """
+    match = re.fullmatch(r"\s*([0-9]+)\s*/\s*([0-9]+)\s*", string)
+    if match is None:
+        raise ArgumentTypeError("Invalid shard specified (expected INDEX/COUNT): " + string)
+
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or index >= count:
+        raise ArgumentTypeError("Invalid shard specified (need 0 <= INDEX < COUNT): " + string)
+
+    return index, count
+
+
+def parse_formats(string):
+    """Type handler for argparse: Parses a comma-separated list of output formats (see :const:`OUTPUT_FORMATS`).
+
+    :param string: List of formats to parse.
+    :type string: str
+    :return: List of formats, without duplicates.
+    :rtype: list[str]
+    :raises argparse.ArgumentTypeError: If the list is empty or contains an unknown format.
+    """
+    formats = []
+
+    for output_format in string.split(","):
+        output_format = output_format.strip().lower()
+
+        if output_format not in OUTPUT_FORMATS:
+            raise ArgumentTypeError("Unknown output format: " + output_format)
+
+        if output_format not in formats:
+            formats.append(output_format)
+
+    return formats
+
+
 def get_argparser():
     """Get the argument parser for this application.
 
@@ -98,8 +194,8 @@ def get_argparser():
             "-e",
             "--end-date",
             type=parse_date,
-            default=datetime.datetime.now(dateutil.tz.gettz()),
-            help="Last day to include in report, inclusive. Defaults to today."
+            help="Last day to include in report, inclusive. Defaults to today (in --diff mode without --start-date: "
+                 "the last day of the most recent snapshot)."
     )
     argparser.add_argument(
             "-t",
@@ -111,11 +207,72 @@ def get_argparser():
             "--workspace",
             help="Workspace to retrieve data for. Either a workspace ID or a workspace name."
     )
+    argparser.add_argument(
+            "--project",
+            help="Only include these projects in the report. Comma-separated list of project IDs or names (names can "
+                 "be abbreviated as long as they are unambiguous)."
+    )
+    argparser.add_argument(
+            "--client",
+            help="Only include these clients in the report. Comma-separated list of client IDs or names."
+    )
+    argparser.add_argument(
+            "--tag",
+            help="Only include time entries with these tags in the report. Comma-separated list of tag IDs or names."
+    )
     argparser.add_argument(
             "-o",
             "--output",
             default="summary_{end_date:%Y}-{end_date:%m}.pdf",
-            help="Output file. Can include {start_date} and {end_date} placeholders. Default: `%(default)s'"
+            help="Output file for the PDF format. Can include {start_date}, {end_date} and {workspace} "
+                 "placeholders. Default: `%(default)s'"
+    )
+    argparser.add_argument(
+            "--format",
+            type=parse_formats,
+            default="pdf",
+            help="Comma-separated list of output formats: pdf, json, csv. The PDF and JSON reports are fetched "
+                 "concurrently; the CSV file is derived from the JSON report. The JSON report is always grouped by "
+                 "project and subgrouped by user. The json and csv formats cannot be used together with --split-by "
+                 "or --diff. Default: %(default)s"
+    )
+    argparser.add_argument(
+            "--json-output",
+            default="summary_{end_date:%Y}-{end_date:%m}.json",
+            help="Output file for the JSON format. Can include the same placeholders as --output. "
+                 "Default: `%(default)s'"
+    )
+    argparser.add_argument(
+            "--csv-output",
+            default="summary_{end_date:%Y}-{end_date:%m}.csv",
+            help="Output file for the CSV format. Can include the same placeholders as --output. "
+                 "Default: `%(default)s'"
+    )
+    argparser.add_argument(
+            "--split-by",
+            choices=report.SPLIT_FIELDS,
+            help="Instead of a PDF report, fetch a single JSON report and write one CSV file per client, project or "
+                 "user (see --split-output)."
+    )
+    argparser.add_argument(
+            "--split-output",
+            default="{group}_{end_date:%Y}-{end_date:%m}.csv",
+            help="Output file template for --split-by. Can include the placeholders allowed for --output and "
+                 "{group}, which is replaced by the client, project or user name. The placeholder named like the "
+                 "--split-by value (e. g. {client}) can be used as well. Default: `%(default)s'"
+    )
+    argparser.add_argument(
+            "--diff",
+            action="store_true",
+            help="Instead of a PDF report, fetch a JSON report and only write the differences to the report fetched "
+                 "last time for the same workspace and start date (see --diff-output). Unless --start-date is given, "
+                 "the period of the most recent snapshot is compared again. The end date is not stored."
+    )
+    argparser.add_argument(
+            "--diff-output",
+            default="summary_diff_{end_date:%Y}-{end_date:%m}.json",
+            help="Output file template for --diff. Can include the same placeholders as --output. Use `-' to write "
+                 "to standard output. Default: `%(default)s'"
     )
     argparser.add_argument(
             "-f",
@@ -129,16 +286,86 @@ def get_argparser():
             action="store_true",
             help="Do not update stored end dates."
     )
+    argparser.add_argument(
+            "--index-max-age",
+            type=float,
+            default=86400,
+            help="Time in seconds after which the locally stored workspace, project, client and tag names (and your "
+                 "timezone) are refreshed from Toggl.com. Names which are not known locally always cause a refresh. "
+                 "Default: %(default)s"
+    )
+    argparser.add_argument(
+            "--transport",
+            choices=sorted(transport.TRANSPORTS),
+            default="requests",
+            help="HTTP library to use for API requests. Default: %(default)s"
+    )
+    argparser.add_argument(
+            "--hedge",
+            action="store_true",
+            help="Send a duplicate report request if the first one takes unusually long, and use whichever response "
+                 "arrives first. What is unusually long is learned from the requests of previous invocations."
+    )
+    argparser.add_argument(
+            "--max-cache-age",
+            type=float,
+            help="Use cached user information and reports which are at most this many seconds old instead of fetching "
+                 "them. Older cached user information is used as well, but refreshed in the background. "
+                 "By default, nothing is cached."
+    )
+    argparser.add_argument(
+            "--prefetch",
+            action="store_true",
+            help="Only fetch the user information and the next report into the cache (e. g. from a scheduled job), "
+                 "so that a later invocation using --max-cache-age does not have to wait for them. The report is only "
+                 "used by invocations with the same --end-date (by default, the current day)."
+    )
+    argparser.add_argument(
+            "--shard",
+            type=parse_shard,
+            help="Run as worker INDEX of COUNT workers (e. g. `0/3'), fetching reports for several workspaces. "
+                 "Workspaces are distributed among the workers, which coordinate using the --lease-dir."
+    )
+    argparser.add_argument(
+            "--workspaces",
+            help="Comma-separated list of workspace IDs or names to fetch reports for when using --shard. "
+                 "Defaults to all workspaces of the user."
+    )
+    argparser.add_argument(
+            "--lease-dir",
+            help="Directory shared by all workers (e. g. on NFS) which is used to coordinate them when using --shard."
+    )
+    argparser.add_argument(
+            "--lease-ttl",
+            type=float,
+            default=300,
+            help="Time in seconds after which the jobs of an unresponsive worker are taken over by other workers. "
+                 "Default: %(default)s"
+    )
+    argparser.add_argument(
+            "--jobs",
+            help="JSON file listing several reports to fetch, each with a deadline and an optional priority. Reports "
+                 "are fetched concurrently, earliest deadline first; reports which cannot be fetched before their "
+                 "deadline are skipped. See the README for the file format."
+    )
+    argparser.add_argument(
+            "--job-concurrency",
+            type=int,
+            default=2,
+            help="Maximum number of reports fetched at the same time when using --jobs. Default: %(default)s"
+    )
 
     return argparser
 
 
-# XXX: Locking?
-def get_last_end_date(workspace_id):
+def get_last_end_date(workspace_id, leases=None):
     """Retrieve the last "end date" (for report queries) for a workspace.
 
     :param workspace_id: ID of workspace to retrieve last end date for.
     :type workspace_id: str | int
+    :param leases: If given, then the end date stored in this shared lease directory (see --shard) is used. If there
+        is none, then the end date stored locally is used.
+    :type leases: shard.LeaseDirectory | None
     :return: Last used end date for the workspace or ``None`` if no end date has been stored yet.
     :rtype: None | datetime.datetime
     :raises OSError: If a data file exists, but cannot be read.
@@ -149,6 +376,12 @@ def get_last_end_date(workspace_id):
     # See http://stackoverflow.com/q/1450957
     workspace_id = str(workspace_id)
 
+    if leases is not None:
+        state = leases.load_job_state(workspace_id)
+
+        if state is not None and "end_date" in state:
+            return dateutil.parser.parse(state["end_date"])
+
     for data_dir in BaseDirectory.load_data_paths(APP_SHORTNAME):
         path = os.path.join(data_dir, END_DATES_FILENAME)
 
@@ -167,14 +400,20 @@ def get_last_end_date(workspace_id):
     return None
 
 
-# XXX: Locking?
-def set_last_end_date(workspace_id, date):
+def set_last_end_date(workspace_id, date, leases=None):
     """Set the last "end date" for a workspace (used in report queries).
 
+    Concurrent updates from several threads (see --jobs) are serialized, and the data file is replaced atomically.
+    Concurrent invocations of ``toggl-fetch`` are not coordinated, though: If two of them store an end date at the same
+    time, then one of the updates may get lost. Use --shard to fetch reports for several workspaces in parallel.
+
     :param workspace_id: ID of workspace to set the last used end date for.
     :type workspace_id: int | str
     :param date: End date to store
     :type date: datetime.datetime
+    :param leases: If given, then the end date is stored in this shared lease directory (see --shard) instead of the
+        local data directory, so that all workers see it.
+    :type leases: shard.LeaseDirectory | None
     :return: Nothing.
     :rtype: None
     :raises OSError: If the data file cannot be saved (or existing data cannot be loaded in order to preserve it).
@@ -184,23 +423,31 @@ def set_last_end_date(workspace_id, date):
     # See http://stackoverflow.com/q/1450957
     workspace_id = str(workspace_id)
 
+    if leases is not None:
+        leases.save_job_state(workspace_id, {"end_date": date.isoformat()})
+        return
+
     path = os.path.join(
             BaseDirectory.save_data_path(APP_SHORTNAME),
             END_DATES_FILENAME
     )
 
-    if os.path.exists(path):
-        # Load existing data so that we preserve it.
-        with open(path, "r") as fh:
-            data = json.load(fh)
-    else:
-        data = {}
+    with _end_dates_lock:
+        if os.path.exists(path):
+            # Load existing data so that we preserve it.
+            with open(path, "r") as fh:
+                data = json.load(fh)
+        else:
+            data = {}
+
+        data[workspace_id] = date.isoformat()
 
-    data[workspace_id] = date.isoformat()
+        # Write to a temporary file first so that readers never see a partially written file.
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "w") as fh:
+            json.dump(data, fh)
 
-    # XXX: Write safely (write + rename)
-    with open(path, "w") as fh:
-        json.dump(data, fh)
+        os.replace(tmp_path, path)
 
 
 def set_argparser_defaults_from_config(argparser):
@@ -252,6 +499,31 @@ def set_argparser_defaults_from_config(argparser):
     argparser.set_defaults(**defaults)
 
 
+def check_output_template(option, template, **placeholders):
+    """Check whether an output file template can be filled in with the given placeholders.
+
+    :param option: Name of the command line option specifying the template, used in error messages.
+    :type option: str
+    :param template: The template.
+    :type template: str
+    :param placeholders: Example values for the placeholders which are available for the template.
+    :type placeholders: dict
+    :return: ``True`` if the template is valid, ``False`` otherwise. In the latter case, an error is logged.
+    :rtype: bool
+    """
+    try:
+        template.format(**placeholders)
+    except KeyError as e:
+        logging.error("Output file template `%s' (%s) contains an unknown placeholder: {%s}", template, option,
+                      e.args[0])
+        return False
+    except (IndexError, ValueError, AttributeError) as e:
+        logging.error("Invalid output file template `%s' (%s): %s", template, option, e)
+        return False
+
+    return True
+
+
 def check_argparser_arguments(args):
     """Ensure that all necessary program arguments are given either in the config file
     (see :func:`set_argparser_defaults_from_config`) or on the command line.
@@ -259,7 +531,8 @@ def check_argparser_arguments(args):
     The following arguments need to be given either in the config file or on the command line:
 
     - ``--api-token`` (``api_token``)
-    - ``--workspace`` (``workspace``)
+    - ``--workspace`` (``workspace``), unless ``--shard`` or ``--jobs`` is given
+    - ``--lease-dir`` (``lease_dir``), if ``--shard`` is given
 
     :param args: Parsed command line arguments, i. e. the result returned by :meth:`argparse.ArgumentParser.parse_args`.
     :type args: argparse.Namespace
@@ -273,14 +546,59 @@ def check_argparser_arguments(args):
         logging.error("Please specify an API token, either in the configuration file or on the command line.")
         result = False
 
-    if args.workspace is None:
+    if args.shard is None and args.jobs is None and args.workspace is None:
         logging.error("Please specify a workspace, either in the configuration file or on the command line.")
         result = False
 
+    if args.prefetch and args.shard is not None:
+        logging.error("--prefetch and --shard cannot be used together.")
+        result = False
+
+    if args.jobs is not None and (args.prefetch or args.shard is not None):
+        logging.error("--jobs cannot be used together with --prefetch or --shard.")
+        result = False
+
+    if args.jobs is not None and args.job_concurrency < 1:
+        logging.error("--job-concurrency must be at least 1.")
+        result = False
+
+    if args.diff and (args.project or args.client or args.tag):
+        logging.error("--diff cannot be used together with --project, --client or --tag.")
+        result = False
+
+    if args.split_by is not None and args.diff:
+        logging.error("--split-by and --diff cannot be used together.")
+        result = False
+
+    if (args.split_by is not None or args.diff) and ("json" in args.format or "csv" in args.format):
+        logging.error("--format json or csv cannot be used together with --split-by or --diff.")
+        result = False
+
+    if args.shard is not None and args.lease_dir is None:
+        logging.error("Please specify a lease directory when using --shard.")
+        result = False
+
+    # Check the output file templates which are going to be used, so that an invalid placeholder does not only show up
+    # after the report has been downloaded.
+    now = datetime.datetime.now(dateutil.tz.gettz())
+    placeholders = dict(start_date=now, end_date=now, workspace="1")
+
+    if args.split_by is not None:
+        split_placeholders = dict(placeholders, group="group", **{args.split_by: "group"})
+        result = check_output_template("--split-output", args.split_output, **split_placeholders) and result
+    elif args.diff:
+        if args.diff_output != "-":
+            result = check_output_template("--diff-output", args.diff_output, **placeholders) and result
+    else:
+        for output_format in args.format:
+            dest = OUTPUT_FORMATS[output_format]
+            option = "--" + dest.replace("_", "-")
+            result = check_output_template(option, getattr(args, dest), **placeholders) and result
+
     return result
 
 
-def determine_end_date(workspace_id):
+def determine_end_date(workspace_id, leases=None):
     """Automatically determine an end date for a workspace, intended to be used as the end of a date range (used in
     report queries for that workspace).
 
@@ -289,6 +607,8 @@ def determine_end_date(workspace_id):
 
     :param workspace_id: ID of workspace to determine an end date for.
     :type workspace_id: str | int
+    :param leases: Shared lease directory to read the last used end date from, see :func:`get_last_end_date`.
+    :type leases: shard.LeaseDirectory | None
     :return: End date for this workspace.
     :rtype: datetime.datetime
     :raises OSError: If a data file exists, but cannot be read.
@@ -297,7 +617,7 @@ def determine_end_date(workspace_id):
     :raises OverflowError: If the data file is corrupt (contains invalid date which cannot be parsed).
     """
     # Try to retrieve the last used end date for the workspace:
-    start_date = get_last_end_date(workspace_id)
+    start_date = get_last_end_date(workspace_id, leases)
 
     if start_date is None:
         # No last end date stored, use default of "4 weeks ago":
@@ -333,6 +653,969 @@ def init_logging():
         logging.getLogger("requests.packages.urllib3").setLevel(logging.WARNING)
 
 
+def get_index_path(api_token):
+    """Get the path of the name index file (see :mod:`.index`) for an API token.
+
+    :param api_token: Toggl API token.
+    :type api_token: str
+    :return: Path of the index file.
+    :rtype: str
+    """
+    return os.path.join(
+            BaseDirectory.save_data_path(APP_SHORTNAME),
+            INDEX_FILENAME % hashlib.sha256(api_token.encode("utf-8")).hexdigest()[:16]
+    )
+
+
+def load_latency_samples(toggl_reports):
+    """Seed the hedging threshold of a reports API client with the request latencies saved by a previous invocation.
+
+    Errors are logged, but otherwise ignored: The threshold is simply learned from scratch then.
+
+    :param toggl_reports: Reports API client.
+    :type toggl_reports: api.TogglReports
+    :return: Nothing.
+    :rtype: None
+    """
+    path = os.path.join(BaseDirectory.save_data_path(APP_SHORTNAME), LATENCIES_FILENAME)
+
+    try:
+        with open(path, "r") as fh:
+            samples = json.load(fh)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        logging.warning("Cannot load request latencies: %s", e)
+        return
+
+    if not isinstance(samples, dict):
+        logging.warning("Ignoring corrupt request latencies file")
+        return
+
+    toggl_reports.add_latency_samples({
+        url: [float(latency) for latency in latencies if isinstance(latency, (int, float))]
+        for url, latencies in samples.items()
+        if isinstance(latencies, list)
+    })
+
+
+def save_latency_samples(toggl_reports):
+    """Save the request latencies recorded by a reports API client for the next invocation.
+
+    Errors are logged, but otherwise ignored.
+
+    :param toggl_reports: Reports API client.
+    :type toggl_reports: api.TogglReports
+    :return: Nothing.
+    :rtype: None
+    """
+    path = os.path.join(BaseDirectory.save_data_path(APP_SHORTNAME), LATENCIES_FILENAME)
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+
+    try:
+        with open(tmp_path, "w") as fh:
+            json.dump(toggl_reports.get_latency_samples(), fh)
+
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning("Cannot save request latencies: %s", e)
+
+
+def update_name_index(toggl_api, name_index, index_path, fresh=False):
+    """Update the name index (including the timezone of the user) from the user information and save it.
+
+    If the index is not empty, then only the objects changed since its last update are requested -- unless cached user
+    information is used anyway.
+
+    :param toggl_api: API client to use.
+    :type toggl_api: api.Toggl | cache.CachedToggl
+    :param name_index: Name index to update.
+    :type name_index: index.NameIndex
+    :param index_path: Path of the index file.
+    :type index_path: str
+    :param fresh: If ``True``, then cached user information is not used.
+    :type fresh: bool
+    :return: Nothing.
+    :rtype: None
+    :raises api.APIError: See :meth:`.api.Toggl.get_user_info`.
+    :raises json.JSONDecodeError: See :meth:`.api.Toggl.get_user_info`.
+    :raises requests.RequestException: See :meth:`.api.Toggl.get_user_info`.
+    """
+    if isinstance(toggl_api, cache.CachedToggl):
+        since = None
+        user_info = toggl_api.prefetch_user_info() if fresh else toggl_api.get_user_info()
+    else:
+        since = name_index.since
+        user_info = toggl_api.get_user_info(since=since)
+
+    name_index.update(user_info, incremental=since is not None)
+
+    try:
+        name_index.save(index_path)
+    except OSError as e:
+        logging.warning("Cannot save name index: %s", e)
+
+
+def refresh_name_index(toggl_api, name_index, index_path):
+    """Refresh the name index because a name cannot be resolved. See :meth:`.index.NameIndex.set_refresh`.
+
+    Errors are logged, but otherwise ignored: The name is then simply not found.
+
+    See :func:`update_name_index` for the parameters.
+    """
+    logging.info("Unknown name, refreshing name index")
+
+    try:
+        update_name_index(toggl_api, name_index, index_path, fresh=True)
+    except (api.APIError, json.JSONDecodeError, requests.RequestException) as e:
+        logging.warning("Cannot refresh name index: %s", e)
+
+
+def resolve_name(name_index, kind, name, workspace_id=None):
+    """Resolve a workspace, project, client or tag given by ID or name to an ID, using the name index.
+
+    Errors (no such object, ambiguous name) are logged with level ERROR.
+
+    :param name_index: Name index to use.
+    :type name_index: index.NameIndex
+    :param kind: Kind of object, see :const:`.index.KINDS`.
+    :type kind: str
+    :param name: ID or name of the object.
+    :type name: str | int
+    :param workspace_id: Workspace the object belongs to (ignored for workspaces).
+    :type workspace_id: str | None
+    :return: ID of the object or ``None`` if the name cannot be resolved.
+    :rtype: str | None
+    """
+    name = str(name).strip()
+
+    if re.fullmatch(r"[0-9]+", name):
+        return name
+
+    matches = name_index.resolve(kind, name, workspace_id)
+    kind_name = kind[:-1]
+
+    if not matches:
+        logging.error("Cannot find a %s with that name: %s", kind_name, name)
+        return None
+
+    if len(matches) > 1:
+        logging.error(
+                "The %s name `%s' is ambiguous, it matches: %s",
+                kind_name, name, ", ".join("%s (%s)" % (obj["name"], obj["id"]) for obj in matches)
+        )
+        return None
+
+    logging.debug("Resolved %s name `%s' to ID %s.", kind_name, name, matches[0]["id"])
+    return str(matches[0]["id"])
+
+
+def resolve_workspace(name_index, workspace):
+    """Resolve a workspace given by ID or name to a workspace ID. See :func:`resolve_name`.
+
+    :param name_index: Name index to use.
+    :type name_index: index.NameIndex
+    :param workspace: Workspace ID or name.
+    :type workspace: str | int
+    :return: Workspace ID or ``None`` if the name cannot be resolved.
+    :rtype: str | None
+    """
+    return resolve_name(name_index, "workspaces", workspace)
+
+
+def get_filter_params(name_index, workspace_id, args):
+    """Get the report parameters for the project, client and tag filters given on the command line.
+
+    :param name_index: Name index to use for resolving names.
+    :type name_index: index.NameIndex
+    :param workspace_id: ID of the workspace the report is for.
+    :type workspace_id: str
+    :param args: Parsed command line arguments.
+    :type args: argparse.Namespace
+    :return: Report parameters (possibly empty), or ``None`` if a name cannot be resolved.
+    :rtype: dict | None
+    """
+    params = {}
+
+    for kind, names in (("projects", args.project), ("clients", args.client), ("tags", args.tag)):
+        if not names:
+            continue
+
+        ids = []
+        for name in names.split(","):
+            if not name.strip():
+                continue
+
+            object_id = resolve_name(name_index, kind, name, workspace_id)
+            if object_id is None:
+                return None
+
+            ids.append(object_id)
+
+        params[FILTER_PARAMS[kind]] = ",".join(ids)
+
+    return params
+
+
+def get_report_period(workspace_id, user_timezone, args, leases=None):
+    """Get the start and end dates for a report, either from the command line or automatically determined.
+
+    In --diff mode without --start-date, the period of the most recent snapshot is used by default, so that the
+    changes to the report which has been delivered last are reported (see :func:`write_diff_report`).
+
+    :param workspace_id: ID of the workspace the report is for.
+    :type workspace_id: str
+    :param user_timezone: Timezone of the Toggl user.
+    :type user_timezone: datetime.tzinfo
+    :param args: Parsed command line arguments.
+    :type args: argparse.Namespace
+    :param leases: Shared lease directory to read the last used end date from, see :func:`get_last_end_date`.
+    :type leases: shard.LeaseDirectory | None
+    :return: Tuple of (start date, end date) or ``None`` if the start date cannot be determined (in this case, an
+        error is logged).
+    :rtype: (datetime.datetime, datetime.datetime) | None
+    """
+    start_date = args.start_date
+    end_date = args.end_date
+
+    if start_date is None and args.diff:
+        try:
+            period = snapshot.find_latest_period(get_snapshot_dir(), workspace_id)
+        except OSError as e:
+            logging.error("Cannot read report snapshots: %s", e)
+            return None
+
+        if period is not None:
+            logging.debug("Using the period of the most recent snapshot")
+            start_date = datetime.datetime.strptime(period[0], "%Y-%m-%d").replace(tzinfo=user_timezone)
+
+            if end_date is None:
+                end_date = datetime.datetime.strptime(period[1], "%Y-%m-%d").replace(tzinfo=user_timezone)
+
+    if end_date is None:
+        end_date = datetime.datetime.now(dateutil.tz.gettz())
+
+    # If no start date was specified, then try to determine a suitable default automatically.
+    if start_date is None:
+        try:
+            start_date = determine_end_date(workspace_id, leases)
+        except (OSError, json.JSONDecodeError, ValueError, OverflowError) as e:
+            logging.error("Cannot determine start date for workspace: %s", e)
+            return None
+
+    logging.info("Start date: %s", start_date)
+    logging.info("End date: %s", end_date)
+
+    return start_date, end_date
+
+
+def get_report_params(workspace_id, start_date, end_date, user_timezone, filter_params):
+    """Get the parameters for :meth:`.api.TogglReports.get_summary` for a report.
+
+    :param workspace_id: ID of the workspace the report is for.
+    :type workspace_id: str
+    :param start_date: First day to include in the report.
+    :type start_date: datetime.datetime
+    :param end_date: Last day to include in the report.
+    :type end_date: datetime.datetime
+    :param user_timezone: Timezone of the Toggl user.
+    :type user_timezone: datetime.tzinfo
+    :param filter_params: Additional parameters for filtering the report, see :func:`get_filter_params`.
+    :type filter_params: dict
+    :return: Report parameters.
+    :rtype: dict
+    """
+    return dict(
+            filter_params,
+            workspace_id=workspace_id,
+            since=start_date.astimezone(user_timezone).date().isoformat(),
+            until=end_date.astimezone(user_timezone).date().isoformat(),
+            order_field="title"
+    )
+
+
+def is_cancelled(cancel):
+    """Check whether a job has been cancelled because it exceeded its deadline (see --jobs).
+
+    :param cancel: Cancel event of the job, if any.
+    :type cancel: threading.Event | None
+    :return: ``True`` iff the job has been cancelled and must not write any output.
+    :rtype: bool
+    """
+    if cancel is not None and cancel.is_set():
+        logging.warning("Job has been cancelled, not writing any output")
+        return True
+
+    return False
+
+
+def fetch_workspace(toggl_reports, name_index, user_timezone, workspace_id, args, leases=None, cancel=None):
+    """Fetch the summary report for a single workspace and store the end date used for it.
+
+    :param toggl_reports: Reports API client to use.
+    :type toggl_reports: api.TogglReports
+    :param name_index: Name index used to resolve project, client and tag names.
+    :type name_index: index.NameIndex
+    :param user_timezone: Timezone of the Toggl user.
+    :type user_timezone: datetime.tzinfo
+    :param workspace_id: ID of the workspace to fetch the report for.
+    :type workspace_id: str
+    :param args: Parsed command line arguments.
+    :type args: argparse.Namespace
+    :param leases: If given, then the last used end date is read from and stored in this shared lease directory
+        instead of the local data directory (see --shard).
+    :type leases: shard.LeaseDirectory | None
+    :param cancel: If given and set, then the job this is run for has been cancelled and no output is written (see
+        --jobs).
+    :type cancel: threading.Event | None
+    :return: A status code, see :func:`main`.
+    :rtype: int
+    """
+    filter_params = get_filter_params(name_index, workspace_id, args)
+    if filter_params is None:
+        return 1
+
+    period = get_report_period(workspace_id, user_timezone, args, leases)
+    if period is None:
+        return 4
+
+    start_date, end_date = period
+    report_params = get_report_params(workspace_id, start_date, end_date, user_timezone, filter_params)
+    template_params = dict(
+            start_date=start_date,
+            end_date=end_date,
+            workspace=workspace_id
+    )
+
+    if args.split_by is not None:
+        status = write_split_reports(toggl_reports, report_params, template_params, args, cancel)
+    elif args.diff:
+        status = write_diff_report(toggl_reports, report_params, template_params, args, cancel)
+    else:
+        status = write_reports(toggl_reports, report_params, template_params, args, cancel)
+
+    if status != 0:
+        return status
+
+    if is_cancelled(cancel):
+        return 6
+
+    # Finally, save the end date for the specified workspace (unless disabled using the --no-update command line
+    # option). In --diff mode, the end date is not stored so that the next invocation compares the same period again,
+    # see get_report_period().
+    if args.diff:
+        logging.debug("NOT storing end date for workspace in --diff mode")
+    elif not args.no_update:
+        logging.debug("Storing end date for workspace")
+
+        try:
+            set_last_end_date(workspace_id, end_date, leases)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error("Cannot store end date: %s", e)
+            return 4
+    else:
+        logging.debug("NOT storing end date for workspace")
+
+    return 0
+
+
+def prefetch_report(toggl_reports, name_index, user_timezone, workspace_id, args):
+    """Fetch the report which the next invocation will most likely ask for into the cache.
+
+    This is the report from the stored end date plus one day (or the given start date) up to the given end date, in
+    the format needed for the other command line arguments. Since the end date defaults to the current day, the
+    prefetched report is only used by invocations on the same day (unless they use the same --end-date).
+
+    :param toggl_reports: Caching reports API client to use.
+    :type toggl_reports: cache.CachedTogglReports
+    :param name_index: Name index used to resolve project, client and tag names.
+    :type name_index: index.NameIndex
+    :param user_timezone: Timezone of the Toggl user.
+    :type user_timezone: datetime.tzinfo
+    :param workspace_id: ID of the workspace to fetch the report for.
+    :type workspace_id: str
+    :param args: Parsed command line arguments.
+    :type args: argparse.Namespace
+    :return: A status code, see :func:`main`.
+    :rtype: int
+    """
+    filter_params = get_filter_params(name_index, workspace_id, args)
+    if filter_params is None:
+        return 1
+
+    period = get_report_period(workspace_id, user_timezone, args)
+    if period is None:
+        return 4
+
+    report_params = get_report_params(workspace_id, period[0], period[1], user_timezone, filter_params)
+
+    try:
+        if args.split_by is not None or args.diff or "json" in args.format or "csv" in args.format:
+            toggl_reports.prefetch_summary(**dict(report_params, **report.SUMMARY_PARAMS))
+
+        if args.split_by is None and not args.diff and "pdf" in args.format:
+            toggl_reports.prefetch_summary(as_pdf=True, **report_params)
+    except (api.APIError, json.JSONDecodeError, requests.RequestException) as e:
+        logging.error("Cannot retrieve summary report: %s", e)
+        return 3
+
+    logging.info("Report for workspace %s up to %s prefetched", workspace_id, report_params["until"])
+    return 0
+
+
+def write_reports(toggl_reports, report_params, template_params, args, cancel=None):
+    """Download a summary report and write it in all requested output formats (see --format).
+
+    The PDF and JSON reports are fetched concurrently. The CSV file is derived from the JSON report.
+
+    :param toggl_reports: Reports API client to use.
+    :type toggl_reports: api.TogglReports
+    :param report_params: Parameters for :meth:`.api.TogglReports.get_summary`.
+    :type report_params: dict
+    :param template_params: Values for the placeholders in the output file templates.
+    :type template_params: dict
+    :param args: Parsed command line arguments.
+    :type args: argparse.Namespace
+    :param cancel: If given and set, then the job this is run for has been cancelled and no output is written (see
+        --jobs).
+    :type cancel: threading.Event | None
+    :return: A status code, see :func:`main`.
+    :rtype: int
+    """
+    # Where should the output files go?
+    output_paths = {
+        output_format: getattr(args, OUTPUT_FORMATS[output_format]).format(**template_params)
+        for output_format in args.format
+    }
+
+    # Refuse to overwrite the output files if they exist (unless --force is given).
+    for output_format in args.format:
+        if not args.force and os.path.exists(output_paths[output_format]):
+            logging.error("Output file `%s' exists, not overwriting it.", output_paths[output_format])
+            return 5
+
+    if len(set(output_paths.values())) != len(output_paths):
+        logging.error("Output file templates must produce a distinct file name for each format.")
+        return 1
+
+    # Download the reports, sharing the API client (and thus, its connections).
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        futures = {}
+
+        if "pdf" in args.format:
+            futures["pdf"] = executor.submit(
+                    api.bind_request_urgency(toggl_reports.get_summary),
+                    as_pdf=True,
+                    **report_params
+            )
+
+        if "json" in args.format or "csv" in args.format:
+            futures["json"] = executor.submit(
+                    api.bind_request_urgency(toggl_reports.get_summary),
+                    **dict(report_params, **report.SUMMARY_PARAMS)
+            )
+
+        try:
+            reports = {output_format: future.result() for output_format, future in futures.items()}
+        except (api.APIError, json.JSONDecodeError, requests.RequestException) as e:
+            logging.error("Cannot retrieve summary report: %s", e)
+            return 3
+
+    if is_cancelled(cancel):
+        return 6
+
+    for output_format in args.format:
+        output_path = output_paths[output_format]
+
+        try:
+            if output_format == "pdf":
+                with open(output_path, "wb") as fh:
+                    fh.write(reports["pdf"])
+            elif output_format == "json":
+                with open(output_path, "w", encoding="utf-8") as fh:
+                    json.dump(reports["json"], fh, indent=2)
+            else:
+                report.write_csv(output_path, report.flatten_summary(reports["json"]))
+        except OSError as e:
+            logging.error("Cannot write to output file `%s': %s", output_path, e)
+            return 5
+
+        logging.info("Output written to file: %s", output_path)
+
+    if "json" in reports:
+        return store_snapshot(
+                snapshot.make_snapshot(
+                        reports["json"],
+                        report_params["workspace_id"],
+                        report_params["since"],
+                        report_params["until"]
+                ),
+                report_params
+        )
+
+    return 0
+
+
+def write_split_reports(toggl_reports, report_params, template_params, args, cancel=None):
+    """Download a single summary report as JSON and write one CSV file per client, project or user.
+
+    :param toggl_reports: Reports API client to use.
+    :type toggl_reports: api.TogglReports
+    :param report_params: Parameters for :meth:`.api.TogglReports.get_summary`.
+    :type report_params: dict
+    :param template_params: Values for the placeholders in the output file template.
+    :type template_params: dict
+    :param args: Parsed command line arguments.
+    :type args: argparse.Namespace
+    :param cancel: If given and set, then the job this is run for has been cancelled and no output is written (see
+        --jobs).
+    :type cancel: threading.Event | None
+    :return: A status code, see :func:`main`.
+    :rtype: int
+    """
+    try:
+        summary = toggl_reports.get_summary(**dict(report_params, **report.SUMMARY_PARAMS))
+    except (api.APIError, json.JSONDecodeError, requests.RequestException) as e:
+        logging.error("Cannot retrieve summary report: %s", e)
+        return 3
+
+    new_snapshot = snapshot.make_snapshot(
+            summary,
+            report_params["workspace_id"],
+            report_params["since"],
+            report_params["until"]
+    )
+
+    groups = report.partition(report.flatten_summary(summary), args.split_by)
+    logging.info("Splitting report into %d file(s) by %s", len(groups), args.split_by)
+
+    # Determine all output paths first so that we don't write only some of the files.
+    output_paths = []
+    for group in groups:
+        group_name = report.safe_filename_part(group)
+
+        try:
+            output_path = args.split_output.format(
+                    group=group_name,
+                    **dict(template_params, **{args.split_by: group_name})
+            )
+        except (KeyError, IndexError, ValueError) as e:
+            logging.error("Invalid output file template `%s': %s", args.split_output, e)
+            return 1
+
+        if not args.force and os.path.exists(output_path):
+            logging.error("Output file `%s' exists, not overwriting it.", output_path)
+            return 5
+
+        output_paths.append(output_path)
+
+    if len(set(output_paths)) != len(output_paths):
+        logging.error("Output file template `%s' does not produce a distinct file name for each %s.",
+                      args.split_output, args.split_by)
+        return 1
+
+    if is_cancelled(cancel):
+        return 6
+
+    for output_path, rows in zip(output_paths, groups.values()):
+        try:
+            report.write_csv(output_path, rows)
+        except OSError as e:
+            logging.error("Cannot write to output file `%s': %s", output_path, e)
+            return 5
+
+        logging.info("Output written to file: %s", output_path)
+
+    return store_snapshot(new_snapshot, report_params)
+
+
+def get_snapshot_dir():
+    """Get the directory snapshots are stored in.
+
+    :return: Path of the snapshot directory.
+    :rtype: str
+    """
+    return os.path.join(BaseDirectory.save_data_path(APP_SHORTNAME), SNAPSHOTS_DIRNAME)
+
+
+def get_snapshot_path(snap):
+    """Get the path of the file a snapshot is stored in (see :func:`.snapshot.get_snapshot_path`).
+
+    :param snap: Snapshot as returned by :func:`.snapshot.make_snapshot`.
+    :type snap: dict
+    :return: Path of the snapshot file.
+    :rtype: str
+    """
+    return snapshot.get_snapshot_path(get_snapshot_dir(), snap["workspace"], snap["since"], snap["until"])
+
+
+def store_snapshot(snap, report_params):
+    """Store a snapshot, replacing the previous snapshot for the same workspace and date range.
+
+    Snapshots of filtered reports (see :func:`get_filter_params`) are not stored since they would replace the snapshot
+    of the complete report.
+
+    :param snap: Snapshot as returned by :func:`.snapshot.make_snapshot`.
+    :type snap: dict
+    :param report_params: Parameters the report was requested with.
+    :type report_params: dict
+    :return: A status code, see :func:`main`.
+    :rtype: int
+    """
+    if any(param in report_params for param in FILTER_PARAMS.values()):
+        logging.debug("Not storing snapshot of filtered report")
+        return 0
+
+    try:
+        snapshot.save_snapshot(get_snapshot_path(snap), snap)
+    except OSError as e:
+        logging.error("Cannot store report snapshot: %s", e)
+        return 4
+
+    return 0
+
+
+def write_diff_report(toggl_reports, report_params, template_params, args, cancel=None):
+    """Download a summary report as JSON and write the differences to the last snapshot of the same report.
+
+    The last snapshot is the one with the same start date and the latest end date up to the current one (see
+    :func:`.snapshot.find_previous_snapshot`). When using the default dates, the period of the most recent snapshot
+    is used (see :func:`get_report_period`), so each invocation reports the changes to the same report since the
+    previous one.
+
+    :param toggl_reports: Reports API client to use.
+    :type toggl_reports: api.TogglReports
+    :param report_params: Parameters for :meth:`.api.TogglReports.get_summary`.
+    :type report_params: dict
+    :param template_params: Values for the placeholders in the output file template.
+    :type template_params: dict
+    :param args: Parsed command line arguments.
+    :type args: argparse.Namespace
+    :param cancel: If given and set, then the job this is run for has been cancelled and no output is written (see
+        --jobs).
+    :type cancel: threading.Event | None
+    :return: A status code, see :func:`main`.
+    :rtype: int
+    """
+    output_path = args.diff_output.format(**template_params)
+
+    # Refuse to overwrite the output file if it exists (unless --force is given).
+    if output_path != "-" and not args.force and os.path.exists(output_path):
+        logging.error("Output file `%s' exists, not overwriting it.", output_path)
+        return 5
+
+    try:
+        summary = toggl_reports.get_summary(**dict(report_params, **report.SUMMARY_PARAMS))
+    except (api.APIError, json.JSONDecodeError, requests.RequestException) as e:
+        logging.error("Cannot retrieve summary report: %s", e)
+        return 3
+
+    new_snapshot = snapshot.make_snapshot(
+            summary,
+            report_params["workspace_id"],
+            report_params["since"],
+            report_params["until"]
+    )
+
+    try:
+        old_path = snapshot.find_previous_snapshot(
+                get_snapshot_dir(),
+                new_snapshot["workspace"],
+                new_snapshot["since"],
+                new_snapshot["until"]
+        )
+        old_snapshot = snapshot.load_snapshot(old_path) if old_path is not None else None
+    except (OSError, json.JSONDecodeError) as e:
+        logging.error("Cannot load previous report snapshot: %s", e)
+        return 4
+
+    if old_snapshot is None:
+        logging.info("No previous snapshot for this workspace and start date, reporting all data as added")
+    else:
+        logging.info("Comparing with the snapshot of %s to %s", old_snapshot["since"], old_snapshot["until"])
+
+    diff = snapshot.diff_snapshots(old_snapshot, new_snapshot)
+    if snapshot.is_empty_diff(diff):
+        logging.info("No changes since the previous snapshot")
+
+    if is_cancelled(cancel):
+        return 6
+
+    try:
+        if output_path == "-":
+            json.dump(diff, sys.stdout, indent=2)
+            sys.stdout.write("\n")
+        else:
+            with open(output_path, "w", encoding="utf-8") as fh:
+                json.dump(diff, fh, indent=2)
+
+            logging.info("Output written to file: %s", output_path)
+    except OSError as e:
+        logging.error("Cannot write to output file `%s': %s", output_path, e)
+        return 5
+
+    # Only replace the snapshot after the differences have been written, so that they cannot get lost. The snapshot of
+    # a shorter period is kept, since it belongs to a report which has been delivered as well.
+    return store_snapshot(new_snapshot, report_params)
+
+
+def fetch_sharded(toggl_reports, name_index, user_timezone, args):
+    """Fetch summary reports for several workspaces as one of several coordinated workers (see :mod:`.shard`).
+
+    :param toggl_reports: Reports API client to use.
+    :type toggl_reports: api.TogglReports
+    :param name_index: Name index used to resolve names.
+    :type name_index: index.NameIndex
+    :param user_timezone: Timezone of the Toggl user.
+    :type user_timezone: datetime.tzinfo
+    :param args: Parsed command line arguments.
+    :type args: argparse.Namespace
+    :return: The highest status code of all workspaces fetched by this worker, see :func:`main`.
+    :rtype: int
+    """
+    if args.workspaces:
+        workspace_ids = []
+
+        for workspace in args.workspaces.split(","):
+            workspace = workspace.strip()
+            if not workspace:
+                continue
+
+            workspace_id = resolve_workspace(name_index, workspace)
+            if workspace_id is None:
+                return 1
+
+            workspace_ids.append(workspace_id)
+    else:
+        workspace_ids = [str(workspace["id"]) for workspace in name_index.all("workspaces")]
+
+    worker_index, worker_count = args.shard
+    logging.info("Running as worker %d of %d for %d workspace(s)", worker_index, worker_count, len(workspace_ids))
+
+    try:
+        leases = shard.LeaseDirectory(args.lease_dir, args.lease_ttl)
+
+        # All workers need to agree on the run and its end date, even if their clocks are on either side of midnight.
+        end_date = args.end_date if args.end_date is not None else datetime.datetime.now(dateutil.tz.gettz())
+        run, run_data = leases.join_run(
+                end_date.astimezone(user_timezone).date().isoformat(),
+                {"end_date": end_date.isoformat()}
+        )
+
+        job_args = Namespace(**vars(args))
+        if not args.diff or args.start_date is not None or args.end_date is not None:
+            # Otherwise, the period of the most recent snapshot of each workspace is used, see get_report_period().
+            job_args.end_date = dateutil.parser.parse(run_data["end_date"])
+
+        def run_job(workspace_id):
+            logging.info("Fetching report for workspace %s", workspace_id)
+            return fetch_workspace(toggl_reports, name_index, user_timezone, workspace_id, job_args, leases)
+
+        results = shard.run_sharded(workspace_ids, run_job, leases, worker_index, worker_count, run)
+    except OSError as e:
+        logging.error("Cannot use lease directory `%s': %s", args.lease_dir, e)
+        return 4
+
+    for workspace_id, status in sorted(results.items()):
+        logging.info("Workspace %s: %s", workspace_id, "OK" if status == 0 else "failed (status %d)" % status)
+
+    return max(results.values(), default=0)
+
+
+def parse_job(spec, args, start_time):
+    """Parse a job description from a --jobs file.
+
+    :param spec: Job description.
+    :type spec: dict
+    :param args: Parsed command line arguments, used as defaults for the settings of the job.
+    :type args: argparse.Namespace
+    :param start_time: Time (UNIX timestamp) relative to which deadlines given in seconds are interpreted.
+    :type start_time: float
+    :return: Tuple of (workspace, deadline as UNIX timestamp, priority, estimated duration or ``None``, arguments for
+        the job). The arguments for the job are a copy of ``args`` with the settings from the job description applied.
+    :rtype: (str, float, int, float | None, argparse.Namespace)
+    :raises ValueError: If the job description is invalid.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("Job description must be an object")
+
+    unknown = set(spec) - {"workspace", "deadline", "priority", "estimate"} - set(JOB_OPTIONS)
+    if unknown:
+        raise ValueError("Unknown setting(s): " + ", ".join(sorted(unknown)))
+
+    workspace = spec.get("workspace")
+    if not isinstance(workspace, (str, int)) or isinstance(workspace, bool):
+        raise ValueError("Please specify a workspace (ID or name)")
+
+    deadline = spec.get("deadline")
+    if isinstance(deadline, str):
+        try:
+            deadline = parse_date(deadline).timestamp()
+        except ArgumentTypeError as e:
+            raise ValueError(str(e)) from e
+    elif isinstance(deadline, (int, float)) and not isinstance(deadline, bool):
+        deadline = start_time + deadline
+    else:
+        raise ValueError("Please specify a deadline (a date or a number of seconds)")
+
+    priority = spec.get("priority", 0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        raise ValueError("Priority must be an integer")
+
+    estimate = spec.get("estimate")
+    if estimate is not None and (not isinstance(estimate, (int, float)) or isinstance(estimate, bool)):
+        raise ValueError("Estimate must be a number of seconds")
+
+    job_args = Namespace(**vars(args))
+    job_args.workspace = str(workspace)
+
+    # Type handlers for the settings which are not plain strings, as used by the argument parser.
+    type_handlers = {
+        "start_date": parse_date,
+        "end_date": parse_date,
+        "format": parse_formats,
+    }
+
+    for name in JOB_OPTIONS:
+        if name not in spec:
+            continue
+
+        value = spec[name]
+        if not isinstance(value, str):
+            raise ValueError("Setting `%s' must be a string" % name)
+
+        type_handler = type_handlers.get(name)
+        if type_handler is not None:
+            try:
+                value = type_handler(value)
+            except ArgumentTypeError as e:
+                raise ValueError(str(e)) from e
+
+        setattr(job_args, name, value)
+
+    return job_args.workspace, deadline, priority, estimate, job_args
+
+
+def run_job(toggl_reports, name_index, user_timezone, workspace_id, args, deadline, priority, cancel):
+    """Fetch the summary report for a single workspace as a job (see :func:`run_jobs`).
+
+    The API requests of the job are made with its deadline and priority, so that more urgent jobs get to make their
+    requests first when the rate limit is reached (see :func:`.api.request_urgency`). Once the job has been cancelled,
+    its remaining requests fail instead of using up the rate limit.
+
+    :param toggl_reports: Reports API client to use.
+    :type toggl_reports: api.TogglReports
+    :param name_index: Name index used to resolve project, client and tag names.
+    :type name_index: index.NameIndex
+    :param user_timezone: Timezone of the Toggl user.
+    :type user_timezone: datetime.tzinfo
+    :param workspace_id: ID of the workspace to fetch the report for.
+    :type workspace_id: str
+    :param args: Command line arguments, including the settings of the job.
+    :type args: argparse.Namespace
+    :param deadline: Deadline of the job (UNIX timestamp).
+    :type deadline: float
+    :param priority: Priority of the job.
+    :type priority: int
+    :param cancel: Cancel event of the job, see :class:`.jobs.Job`.
+    :type cancel: threading.Event
+    :return: A status code, see :func:`main`.
+    :rtype: int
+    """
+    with api.request_urgency(deadline, priority, cancel):
+        return fetch_workspace(toggl_reports, name_index, user_timezone, workspace_id, args, cancel=cancel)
+
+
+def run_jobs(toggl_reports, name_index, user_timezone, args):
+    """Fetch the summary reports listed in the --jobs file, earliest deadline first (see :mod:`.jobs`).
+
+    :param toggl_reports: Reports API client to use.
+    :type toggl_reports: api.TogglReports
+    :param name_index: Name index used to resolve names.
+    :type name_index: index.NameIndex
+    :param user_timezone: Timezone of the Toggl user.
+    :type user_timezone: datetime.tzinfo
+    :param args: Parsed command line arguments.
+    :type args: argparse.Namespace
+    :return: The highest status code of all jobs, see :func:`main`.
+    :rtype: int
+    """
+    start_time = time.time()
+
+    try:
+        with open(args.jobs, "r", encoding="utf-8") as fh:
+            specs = json.load(fh)
+    except (OSError, ValueError) as e:
+        logging.error("Cannot load job file `%s': %s", args.jobs, e)
+        return 1
+
+    if not isinstance(specs, list):
+        logging.error("Job file `%s' must contain a list of jobs", args.jobs)
+        return 1
+
+    runner = jobs.JobRunner(args.job_concurrency)
+
+    for number, spec in enumerate(specs, 1):
+        try:
+            workspace, deadline, priority, estimate, job_args = parse_job(spec, args, start_time)
+        except ValueError as e:
+            logging.error("Invalid job #%d: %s", number, e)
+            return 1
+
+        if not check_argparser_arguments(job_args):
+            logging.error("Invalid job #%d", number)
+            return 1
+
+        workspace_id = resolve_workspace(name_index, workspace)
+        if workspace_id is None:
+            return 1
+
+        runner.add(jobs.Job(
+                "#%d (workspace %s)" % (number, workspace_id),
+                functools.partial(
+                        run_job, toggl_reports, name_index, user_timezone, workspace_id, job_args, deadline, priority
+                ),
+                deadline,
+                priority,
+                estimate
+        ))
+
+    logging.info("Running %d job(s), at most %d at a time", len(specs), args.job_concurrency)
+    results = runner.run()
+
+    status = 0
+    logging.info("Job summary:")
+
+    for result in results:
+        if result.outcome == jobs.OUTCOME_SKIPPED:
+            logging.info("  %s: %s", result.name, result.outcome)
+            status = max(status, 6)
+            continue
+
+        logging.info(
+                "  %s: %s%s (waited %.1f s, ran %.1f s)",
+                result.name,
+                result.outcome,
+                " (status %d)" % result.status if result.status else "",
+                result.wait,
+                result.duration
+        )
+
+        if result.outcome == jobs.OUTCOME_TIMED_OUT:
+            status = max(status, 6)
+        elif result.outcome == jobs.OUTCOME_FAILED:
+            # Jobs raising an exception have no status code.
+            status = max(status, result.status if result.status is not None else 4)
+
+    logging.info(
+            "%d of %d job(s) finished before their deadline",
+            sum(1 for result in results if result.outcome == jobs.OUTCOME_OK),
+            len(results)
+    )
+
+    return status
+
+
 def main():
     """Main method for this application.
 
@@ -348,6 +1631,7 @@ def main():
         * 3: Toggl API error
         * 4: Internal error (e. g. got unknown timezone from Toggl API, cannot load/save data file, ...)
         * 5: Cannot write output file
+        * 6: A job did not finish before its deadline and was skipped or cancelled (see --jobs)
     :rtype: int
     """
     # Set up logging:
@@ -372,89 +1656,86 @@ def main():
         return 1
 
     # Set up Toggl.com API wrappers
-    toggl_api = api.Toggl(args.api_token)
-    toggl_reports = api.TogglReports(args.api_token)
-
-    # We need to retrieve the user info from Toggl to determine the correct timezone for the date parameters.
     try:
-        user_info = toggl_api.get_user_info()
-    except (api.APIError, json.JSONDecodeError, requests.RequestException) as e:
-        logging.error("Cannot retrieve user information: %s", e)
-        return 3
-
-    # If the user specified a workspace name and not an ID, then try to find a workspace with that name and use its ID.
-    if not re.fullmatch(r"[0-9]+", args.workspace):
-        resolved_workspace = toggl_api.get_workspace_by_name_from_user_info(user_info, args.workspace)
-
-        if resolved_workspace is None:
-            logging.error("Cannot find a workspace with that name: %s", args.workspace)
-            return 1
-
-        logging.debug("Resolved workspace name `%s' to ID %d.", args.workspace, resolved_workspace["id"])
-        args.workspace = resolved_workspace["id"]
-
-    # Determine the timezone of the Toggl user
-    user_timezone = dateutil.tz.gettz(user_info["data"]["timezone"])
-    if user_timezone is None:
-        logging.error("Unknown timezone: %s", user_info["data"]["timezone"])
-        return 4
+        toggl_api = api.Toggl(args.api_token, args.transport)
+        toggl_reports = api.TogglReports(args.api_token, args.transport, hedge=args.hedge)
+    except api.APIError as e:
+        logging.error("Cannot set up API client: %s", e)
+        return 1
 
-    logging.debug("User timezone: %s", user_timezone)
+    if args.hedge:
+        # Reuse the latencies seen by previous invocations; a single invocation only makes a few requests, which is
+        # not enough to determine when a request is slow.
+        load_latency_samples(toggl_reports)
 
-    # If no start date was specified, then try to determine a suitable default automatically.
-    if args.start_date is None:
+    if args.prefetch or args.max_cache_age is not None:
         try:
-            args.start_date = determine_end_date(args.workspace)
-        except (OSError, json.JSONDecodeError, ValueError, OverflowError) as e:
-            logging.error("Cannot determine start date for workspace: %s", e)
+            response_cache = cache.ResponseCache(BaseDirectory.save_cache_path(APP_SHORTNAME))
+        except OSError as e:
+            logging.error("Cannot create cache directory: %s", e)
             return 4
 
-    logging.info("Start date: %s", args.start_date)
-    logging.info("End date: %s", args.end_date)
+        # Cache keys include the report period, so entries for past periods would otherwise pile up forever.
+        try:
+            removed = response_cache.prune(CACHE_PRUNE_AGE)
+        except OSError as e:
+            logging.warning("Cannot remove old cache entries: %s", e)
+        else:
+            logging.debug("Removed %d old cache entries", removed)
+
+        max_cache_age = args.max_cache_age if args.max_cache_age is not None else 0
+        toggl_api = cache.CachedToggl(toggl_api, args.api_token, response_cache, max_cache_age)
+        toggl_reports = cache.CachedTogglReports(toggl_reports, args.api_token, response_cache, max_cache_age)
+
+    # Load the index used to resolve workspace, project, client and tag names.
+    index_path = get_index_path(args.api_token)
+    try:
+        name_index = index.NameIndex.load(index_path)
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning("Cannot load name index, rebuilding it: %s", e)
+        name_index = index.NameIndex()
+
+    # The index also stores the timezone of the Toggl user, which we need for the date parameters. Only contact the
+    # API if we don't know the timezone yet or if the index is due for a refresh.
+    if args.prefetch or name_index.timezone is None or name_index.is_stale(args.index_max_age):
+        try:
+            update_name_index(toggl_api, name_index, index_path, fresh=args.prefetch)
+        except (api.APIError, json.JSONDecodeError, requests.RequestException) as e:
+            if args.prefetch or name_index.timezone is None:
+                logging.error("Cannot retrieve user information: %s", e)
+                return 3
 
-    # Where should the downloaded PDF file go?
-    output_path = args.output.format(
-            start_date=args.start_date,
-            end_date=args.end_date
-    )
+            logging.warning("Cannot refresh name index, using the existing one: %s", e)
 
-    # Refuse to overwrite the output file if it exists (unless --force is given).
-    if not args.force and os.path.exists(output_path):
-        logging.error("Output file `%s' exists, not overwriting it.", output_path)
-        return 5
+    # Names which are not in the index (yet) trigger a refresh.
+    name_index.set_refresh(functools.partial(refresh_name_index, toggl_api, name_index, index_path))
 
-    # Download and save the generated PDF file.
-    try:
-        pdf_data = toggl_reports.get_summary(
-                workspace_id=args.workspace,
-                since=args.start_date.astimezone(user_timezone).date().isoformat(),
-                until=args.end_date.astimezone(user_timezone).date().isoformat(),
-                order_field="title",
-                as_pdf=True
-        )
+    # Determine the timezone of the Toggl user
+    user_timezone = dateutil.tz.gettz(name_index.timezone)
+    if user_timezone is None:
+        logging.error("Unknown timezone: %s", name_index.timezone)
+        return 4
 
-        with open(output_path, "wb") as fh:
-            fh.write(pdf_data)
-    except (api.APIError, json.JSONDecodeError, requests.RequestException) as e:
-        logging.error("Cannot retrieve summary report: %s", e)
-        return 3
-    except IOError as e:
-        logging.error("Cannot write to output file `%s': %s", output_path, e)
-        return 5
+    logging.debug("User timezone: %s", user_timezone)
 
-    logging.info("Output written to file: %s", output_path)
+    if args.shard is not None:
+        status = fetch_sharded(toggl_reports, name_index, user_timezone, args)
+    elif args.jobs is not None:
+        status = run_jobs(toggl_reports, name_index, user_timezone, args)
+    else:
+        # If the user specified a workspace name and not an ID, then try to find a workspace with that name and use
+        # its ID.
+        workspace_id = resolve_workspace(name_index, args.workspace)
+        if workspace_id is None:
+            return 1
 
-    # Finally, save the end date for the specified workspace (unless disabled using the --no-update command line
-    # option).
-    if not args.no_update:
-        logging.debug("Storing end date for workspace")
+        if args.prefetch:
+            status = prefetch_report(toggl_reports, name_index, user_timezone, workspace_id, args)
+        else:
+            status = fetch_workspace(toggl_reports, name_index, user_timezone, workspace_id, args)
 
-        try:
-            set_last_end_date(args.workspace, args.end_date)
-        except (OSError, json.JSONDecodeError) as e:
-            logging.error("Cannot store end date: %s", e)
-            return 4
-    else:
-        logging.debug("NOT storing end date for workspace")
+    if args.hedge:
+        logging.debug("Hedging statistics: %s", toggl_reports.hedge_stats)
+        save_latency_samples(toggl_reports)
 
-    return 0
+    return status
@@ -0,0 +1,294 @@
+"""Provides a persistent index of Toggl.com workspaces, projects, clients and tags for fast name resolution.
+
+This file is part of toggl-fetch, see https://github.com/Tblue/toggl-fetch.
+
+Copyright 2016  Tilman Blumenbach
+
+toggl-fetch is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+toggl-fetch is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+
+
+# Kinds of objects stored in the index. These are the keys of the related data in the user information returned by
+# api.Toggl.get_user_info().
+KINDS = ("workspaces", "projects", "clients", "tags")
+
+# Version of the on-disk format.
+_FORMAT_VERSION = 1
+
+
+class NameIndex:
+    """An index mapping names of workspaces, projects, clients and tags to the corresponding objects.
+
+    Each indexed object is a ``dict`` with the keys ``id``, ``name`` and ``wid`` (the workspace ID; ``None`` for
+    workspaces). Lookups are case-insensitive; prefix lookups are supported as well.
+
+    The index is built from the user information returned by :meth:`.api.Toggl.get_user_info` and can be refreshed
+    incrementally, using the ``since`` timestamp stored in the index. It also stores the user's timezone, so that
+    reports can be fetched without requesting the user information at all as long as all names are known.
+    """
+    def __init__(self):
+        self.since = None
+        self.timezone = None
+        self.updated = None
+        self._refresh = None
+        self._refresh_lock = threading.Lock()
+        self._objects = {kind: {} for kind in KINDS}
+        self._by_name = {}
+        self._sorted_names = {}
+
+        self._rebuild()
+
+    @classmethod
+    def load(cls, path):
+        """Load an index from a file.
+
+        :param path: Path of the index file.
+        :type path: str
+        :return: The loaded index. An empty index is returned if the file does not exist or uses an unknown format
+            (including JSON values other than objects).
+        :rtype: NameIndex
+        :raises OSError: If the file exists, but cannot be read.
+        :raises json.JSONDecodeError: If the file is corrupt.
+        """
+        index = cls()
+
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return index
+
+        if not isinstance(data, dict) or data.get("version") != _FORMAT_VERSION:
+            return index
+
+        index.since = data["since"]
+        index.timezone = data.get("timezone")
+        index.updated = data.get("updated")
+        for kind in KINDS:
+            index._objects[kind] = {str(obj["id"]): obj for obj in data["objects"].get(kind, [])}
+
+        index._rebuild()
+        return index
+
+    def save(self, path):
+        """Save the index to a file (atomically, by writing to a temporary file first).
+
+        :param path: Path of the index file.
+        :type path: str
+        :return: Nothing.
+        :rtype: None
+        :raises OSError: If the file cannot be written.
+        """
+        data = {
+            "version": _FORMAT_VERSION,
+            "since": self.since,
+            "timezone": self.timezone,
+            "updated": self.updated,
+            "objects": {kind: list(self._objects[kind].values()) for kind in KINDS},
+        }
+
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, separators=(",", ":"))
+
+        os.replace(tmp_path, path)
+
+    def _rebuild(self):
+        """Rebuild the lookup structures after the indexed objects have changed."""
+        for kind in KINDS:
+            by_name = {}
+
+            for obj in self._objects[kind].values():
+                by_name.setdefault(obj["name"].casefold(), []).append(obj)
+
+            self._by_name[kind] = by_name
+            self._sorted_names[kind] = sorted(by_name)
+
+    def update(self, user_info, incremental):
+        """Update the index from user information.
+
+        :param user_info: User information as returned by :meth:`.api.Toggl.get_user_info`.
+        :type user_info: dict
+        :param incremental: Whether the user information was requested using the ``since`` parameter, i. e. only
+            contains the objects changed since then. If ``False``, then the user information is treated as complete
+            and replaces the contents of the index.
+        :type incremental: bool
+        :return: Nothing.
+        :rtype: None
+        """
+        data = user_info["data"]
+
+        for kind in KINDS:
+            if not incremental:
+                self._objects[kind] = {}
+
+            for obj in data.get(kind) or []:
+                object_id = str(obj["id"])
+
+                if obj.get("server_deleted_at"):
+                    self._objects[kind].pop(object_id, None)
+                else:
+                    self._objects[kind][object_id] = {
+                        "id": obj["id"],
+                        "name": obj.get("name") or "",
+                        "wid": obj.get("wid"),
+                    }
+
+        if not incremental:
+            # The index now reflects the given user information, which may be older than the previous contents (e. g.
+            # if it was cached), so only objects changed since its timestamp are up to date.
+            self.since = user_info.get("since")
+        elif user_info.get("since") is not None:
+            self.since = max(self.since or 0, user_info["since"])
+
+        if data.get("timezone"):
+            self.timezone = data["timezone"]
+
+        self.updated = time.time()
+        self._rebuild()
+
+    def is_stale(self, max_age):
+        """Check whether the index needs to be refreshed.
+
+        :param max_age: Time in seconds after which the index should be refreshed.
+        :type max_age: float
+        :return: ``True`` if the index has never been updated or its last update is older than ``max_age``.
+        :rtype: bool
+        """
+        return self.updated is None or time.time() - self.updated > max_age
+
+    def set_refresh(self, refresh):
+        """Set a function refreshing the index, which is called (at most once) if a name cannot be resolved.
+
+        :param refresh: Function updating this index (see :meth:`update`), called without arguments.
+        :type refresh: () -> None
+        :return: Nothing.
+        :rtype: None
+        """
+        self._refresh = refresh
+
+    def _refresh_once(self):
+        """Call the refresh function if it has not been called yet. Concurrent callers wait for the refresh."""
+        with self._refresh_lock:
+            refresh, self._refresh = self._refresh, None
+
+            if refresh is not None:
+                refresh()
+
+    def __len__(self):
+        return sum(len(objects) for objects in self._objects.values())
+
+    def all(self, kind, workspace_id=None):
+        """Get all indexed objects of a kind.
+
+        :param kind: Kind of objects, see :const:`KINDS`.
+        :type kind: str
+        :param workspace_id: If given, only return objects belonging to this workspace.
+        :type workspace_id: str | int | None
+        :return: The objects, sorted by name.
+        :rtype: list[dict]
+        """
+        return self._filter(
+                [obj for name in self._sorted_names[kind] for obj in self._by_name[kind][name]],
+                workspace_id
+        )
+
+    @staticmethod
+    def _filter(objects, workspace_id):
+        if workspace_id is None:
+            return objects
+
+        return [obj for obj in objects if str(obj["wid"]) == str(workspace_id)]
+
+    def lookup(self, kind, name, workspace_id=None):
+        """Find objects by name (case-insensitive).
+
+        :param kind: Kind of objects, see :const:`KINDS`.
+        :type kind: str
+        :param name: Name to look up.
+        :type name: str
+        :param workspace_id: If given, only return objects belonging to this workspace.
+        :type workspace_id: str | int | None
+        :return: Matching objects.
+        :rtype: list[dict]
+        """
+        return self._filter(self._by_name[kind].get(name.casefold(), []), workspace_id)
+
+    def lookup_prefix(self, kind, prefix, workspace_id=None):
+        """Find objects whose name starts with a prefix (case-insensitive).
+
+        :param kind: Kind of objects, see :const:`KINDS`.
+        :type kind: str
+        :param prefix: Name prefix to look up.
+        :type prefix: str
+        :param workspace_id: If given, only return objects belonging to this workspace.
+        :type workspace_id: str | int | None
+        :return: Matching objects, sorted by name.
+        :rtype: list[dict]
+        """
+        prefix = prefix.casefold()
+        names = self._sorted_names[kind]
+        result = []
+
+        for position in range(bisect.bisect_left(names, prefix), len(names)):
+            if not names[position].startswith(prefix):
+                break
+
+            result.extend(self._by_name[kind][names[position]])
+
+        return self._filter(result, workspace_id)
+
+    def resolve(self, kind, name, workspace_id=None):
+        """Resolve a name to objects, trying increasingly fuzzy matches until something is found.
+
+        The following matches are tried in order: exact (case-sensitive) match, case-insensitive match, prefix match
+        (case-insensitive). If nothing is found, then the index is refreshed (see :meth:`set_refresh`) and the name is
+        resolved again.
+
+        :param kind: Kind of objects, see :const:`KINDS`.
+        :type kind: str
+        :param name: Name to resolve.
+        :type name: str
+        :param workspace_id: If given, only return objects belonging to this workspace.
+        :type workspace_id: str | int | None
+        :return: Matching objects of the first kind of match which found any. If there is more than one object, then
+            the name is ambiguous.
+        :rtype: list[dict]
+        """
+        matches = self._resolve(kind, name, workspace_id)
+
+        if not matches:
+            # Wait for a refresh in progress (started by another thread) as well.
+            self._refresh_once()
+            matches = self._resolve(kind, name, workspace_id)
+
+        return matches
+
+    def _resolve(self, kind, name, workspace_id):
+        matches = self.lookup(kind, name, workspace_id)
+
+        exact_matches = [obj for obj in matches if obj["name"] == name]
+        if exact_matches:
+            return exact_matches
+
+        if matches:
+            return matches
+
+        return self.lookup_prefix(kind, name, workspace_id)
@@ -0,0 +1,195 @@
+"""Runs batches of jobs (e. g. report fetches) with priorities and deadlines, earliest deadline first.
+
+This file is part of toggl-fetch, see https://github.com/Tblue/toggl-fetch.
+
+Copyright 2016  Tilman Blumenbach
+
+toggl-fetch is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+toggl-fetch is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+# The logger used by this module
+_logger = logging.getLogger(__name__)
+
+# Job outcomes
+OUTCOME_OK = "ok"
+OUTCOME_FAILED = "failed"
+OUTCOME_SKIPPED = "skipped"
+OUTCOME_TIMED_OUT = "timed out"
+
+
+class Job:
+    """A job to be run by a :class:`JobRunner`."""
+    def __init__(self, name, run, deadline, priority=0, estimate=None):
+        """Create a new job.
+
+        :param name: Name of the job, used in log messages and results.
+        :type name: str
+        :param run: Function performing the job. It is called in a worker thread with a :class:`threading.Event`
+            which is set when the job exceeds its deadline; the job should then stop without producing any results.
+            It must return a status code (0 means success).
+        :type run: (threading.Event) -> int
+        :param deadline: Time (UNIX timestamp) by which the job must have finished.
+        :type deadline: float
+        :param priority: Priority of the job. Among jobs with the same deadline, jobs with a higher priority run first.
+        :type priority: int
+        :param estimate: Expected duration of the job in seconds. If ``None``, then the mean duration of the jobs
+            finished so far is used.
+        :type estimate: float | None
+        """
+        self.name = name
+        self.run = run
+        self.deadline = deadline
+        self.priority = priority
+        self.estimate = estimate
+
+
+JobResult = collections.namedtuple("JobResult", ("name", "outcome", "status", "wait", "duration", "error"))
+JobResult.__doc__ = """Result of a job run by a :class:`JobRunner`.
+
+``outcome`` is one of the ``OUTCOME_*`` constants. ``status`` is the status code returned by the job (``None`` if it
+did not finish). ``wait`` is the time (in seconds) the job waited before it was started, ``duration`` the time it ran
+(both ``None`` if the job was skipped). ``error`` is the exception raised by the job, if any.
+"""
+
+
+class JobRunner:
+    """Runs jobs concurrently, starting them in order of their deadlines (earliest deadline first).
+
+    A job is skipped if, when it is due to be started, it cannot finish before its deadline according to its estimated
+    duration. A running job which exceeds its deadline is reported as timed out and cancelled: the worker thread running
+    it cannot be interrupted, but the job's cancel event is set so that it stops before producing any results.
+
+    Rate limiting is left to the jobs: API clients using the same credentials share a rate limiter (see
+    :class:`.api.RateLimiter`), so concurrent jobs automatically stay within the Toggl.com rate limit. Jobs should make
+    their requests using :func:`.api.request_urgency`, so that the requests of urgent jobs are made first.
+    """
+    def __init__(self, concurrency=2):
+        """Create a new job runner.
+
+        :param concurrency: Maximum number of jobs running at the same time.
+        :type concurrency: int
+        """
+        self._concurrency = concurrency
+        self._queue = []
+        self._counter = itertools.count()
+        self._durations = []
+
+    def add(self, job):
+        """Add a job to the queue.
+
+        :param job: The job.
+        :type job: Job
+        :return: Nothing.
+        :rtype: None
+        """
+        # The counter keeps the order stable for jobs with equal deadlines and priorities.
+        heapq.heappush(self._queue, (job.deadline, -job.priority, next(self._counter), job))
+
+    def _estimate(self, job):
+        """Get the estimated duration of a job in seconds."""
+        if job.estimate is not None:
+            return job.estimate
+
+        if self._durations:
+            return sum(self._durations) / len(self._durations)
+
+        return 0
+
+    async def _worker(self, loop, executor, start_time, results):
+        """Take jobs from the queue and run them until the queue is empty."""
+        while self._queue:
+            job = heapq.heappop(self._queue)[-1]
+            now = time.time()
+            wait = now - start_time
+
+            if now + self._estimate(job) > job.deadline:
+                _logger.warning(
+                        "Skipping job %s: Cannot finish before its deadline (estimated duration: %.1f s)",
+                        job.name, self._estimate(job)
+                )
+                results.append(JobResult(job.name, OUTCOME_SKIPPED, None, None, None, None))
+                continue
+
+            _logger.info("Starting job %s (priority %d, %.1f s until deadline)", job.name, job.priority,
+                         job.deadline - now)
+
+            cancel = threading.Event()
+            future = loop.run_in_executor(executor, job.run, cancel)
+            try:
+                status = await asyncio.wait_for(future, job.deadline - now)
+            except asyncio.TimeoutError:
+                _logger.error("Job %s did not finish before its deadline, cancelling it", job.name)
+                cancel.set()
+                results.append(JobResult(job.name, OUTCOME_TIMED_OUT, None, wait, time.time() - now, None))
+                continue
+            except Exception as e:
+                _logger.error("Job %s failed: %s", job.name, e)
+                results.append(JobResult(job.name, OUTCOME_FAILED, None, wait, time.time() - now, e))
+                continue
+
+            duration = time.time() - now
+            self._durations.append(duration)
+
+            outcome = OUTCOME_OK if status == 0 else OUTCOME_FAILED
+            results.append(JobResult(job.name, outcome, status, wait, duration, None))
+
+    async def run_async(self):
+        """Run all queued jobs.
+
+        :return: Results of all jobs, in the order in which they finished (or were skipped).
+        :rtype: list[JobResult]
+        """
+        loop = asyncio.get_event_loop()
+        results = []
+        start_time = time.time()
+
+        # The number of running jobs is limited by the number of workers. Threads of cancelled jobs keep running until
+        # they notice the cancellation, so allow for one thread per job; otherwise, those threads would block the
+        # following jobs.
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(self._queue), 1))
+        try:
+            await asyncio.gather(*[
+                self._worker(loop, executor, start_time, results)
+                for _ in range(self._concurrency)
+            ])
+        finally:
+            # Don't wait for cancelled jobs still running in the background. Note that the interpreter still waits
+            # for them at exit (usually until their current API request has finished).
+            executor.shutdown(wait=False)
+
+        return results
+
+    def run(self):
+        """Run all queued jobs in a new event loop. See :meth:`run_async`.
+
+        :return: Results of all jobs.
+        :rtype: list[JobResult]
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            return loop.run_until_complete(self.run_async())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
@@ -0,0 +1,136 @@
+"""Helpers for processing summary reports (as returned by the Toggl.com reports API) locally.
+
+This file is part of toggl-fetch, see https://github.com/Tblue/toggl-fetch.
+
+Copyright 2016  Tilman Blumenbach
+
+toggl-fetch is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+toggl-fetch is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
+"""
+
+import collections
+import csv
+import os
+
+
+# Report parameters to use when requesting a summary report which is to be processed by this module. Grouping by
+# project and subgrouping by user makes it possible to partition the report by client, project or user locally.
+SUMMARY_PARAMS = {
+    "grouping": "projects",
+    "subgrouping": "users",
+}
+
+# Fields by which summary report rows can be partitioned.
+SPLIT_FIELDS = ("client", "project", "user")
+
+# Placeholder used for rows without a client, project or user.
+NONE_TITLE = "(none)"
+
+# Columns of CSV files written by write_csv().
+CSV_COLUMNS = ("client", "project", "user", "hours", "amount", "currency")
+
+
+Row = collections.namedtuple("Row", ("project_id", "project", "client", "user", "time", "amount", "currency"))
+Row.__doc__ = """A single (project, user) row of a summary report. ``time`` is given in milliseconds."""
+
+
+def flatten_summary(summary):
+    """Turn a summary report into a flat list of rows.
+
+    The report must have been requested using the parameters in :const:`SUMMARY_PARAMS`.
+
+    :param summary: Summary report as returned by :meth:`.api.TogglReports.get_summary`.
+    :type summary: dict
+    :return: One row per project and user.
+    :rtype: list[Row]
+    """
+    rows = []
+
+    for group in summary.get("data", []):
+        title = group.get("title") or {}
+        project = title.get("project") or NONE_TITLE
+        client = title.get("client") or NONE_TITLE
+
+        for item in group.get("items", []):
+            rows.append(Row(
+                    project_id=group.get("id"),
+                    project=project,
+                    client=client,
+                    user=(item.get("title") or {}).get("user") or NONE_TITLE,
+                    time=item.get("time") or 0,
+                    amount=item.get("sum") or 0,
+                    currency=item.get("cur")
+            ))
+
+    return rows
+
+
+def partition(rows, field):
+    """Partition rows by the value of a field.
+
+    :param rows: Rows to partition, see :func:`flatten_summary`.
+    :type rows: collections.abc.Iterable[Row]
+    :param field: Field to partition by, one of :const:`SPLIT_FIELDS`.
+    :type field: str
+    :return: Mapping from field values to the rows having that value, in order of first appearance.
+    :rtype: collections.OrderedDict[str, list[Row]]
+    """
+    if field not in SPLIT_FIELDS:
+        raise ValueError("Cannot partition by field: %s" % field)
+
+    groups = collections.OrderedDict()
+    for row in rows:
+        groups.setdefault(getattr(row, field), []).append(row)
+
+    return groups
+
+
+def safe_filename_part(name):
+    """Make a client, project or user name usable as part of a file name by replacing path separators.
+
+    :param name: Name to convert.
+    :type name: str
+    :return: Converted name.
+    :rtype: str
+    """
+    for sep in (os.sep, os.altsep, "\0"):
+        if sep:
+            name = name.replace(sep, "_")
+
+    return name
+
+
+def write_csv(path, rows):
+    """Write rows to a CSV file (see :const:`CSV_COLUMNS` for the columns).
+
+    :param path: Path of the file to write.
+    :type path: str
+    :param rows: Rows to write, see :func:`flatten_summary`.
+    :type rows: collections.abc.Iterable[Row]
+    :return: Nothing.
+    :rtype: None
+    :raises OSError: If the file cannot be written.
+    """
+    with open(path, "w", newline="", encoding="utf-8") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(CSV_COLUMNS)
+
+        for row in rows:
+            writer.writerow((
+                    row.client,
+                    row.project,
+                    row.user,
+                    "%.2f" % (row.time / 3600000),
+                    row.amount,
+                    row.currency or ""
+            ))
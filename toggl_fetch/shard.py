@@ -0,0 +1,543 @@
+"""Distributes report fetching across several hosts using consistent hashing and file-based leases.
+
+This file is part of toggl-fetch, see https://github.com/Tblue/toggl-fetch.
+
+Copyright 2016  Tilman Blumenbach
+
+toggl-fetch is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+toggl-fetch is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
+"""
+
+import bisect
+import errno
+import hashlib
+import json
+import logging
+import os
+import os.path
+import re
+import socket
+import threading
+import time
+import uuid
+
+
+# The logger used by this module
+_logger = logging.getLogger(__name__)
+
+
+def _hash(key):
+    """Hash a string to an integer. Used to place keys on the hash ring.
+
+    :param key: String to hash.
+    :type key: str
+    :return: Hash value.
+    :rtype: int
+    """
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+def _safe_name(name):
+    """Turn an arbitrary string into something which can safely be used as part of a file name.
+
+    :param name: String to convert.
+    :type name: str
+    :return: String containing only alphanumeric characters, dots, dashes and underscores.
+    :rtype: str
+    """
+    return re.sub(r"[^A-Za-z0-9._-]", "_", str(name))
+
+
+class HashRing:
+    """A consistent hash ring mapping job keys to workers.
+
+    Each worker is placed on the ring several times ("virtual nodes") so that jobs are distributed evenly. Adding or
+    removing a worker only moves the jobs of that worker.
+    """
+    def __init__(self, workers, replicas=100):
+        """Create a new hash ring.
+
+        :param workers: Worker names.
+        :type workers: collections.abc.Iterable[str]
+        :param replicas: Number of virtual nodes per worker.
+        :type replicas: int
+        """
+        self._ring = sorted(
+                (_hash("{}#{}".format(worker, replica)), str(worker))
+                for worker in workers
+                for replica in range(replicas)
+        )
+        self._hashes = [entry[0] for entry in self._ring]
+
+        if not self._ring:
+            raise ValueError("Hash ring needs at least one worker")
+
+    def get_worker(self, key):
+        """Determine the worker responsible for a job.
+
+        :param key: Job key.
+        :type key: str
+        :return: Name of the responsible worker.
+        :rtype: str
+        """
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._ring)
+        return self._ring[index][1]
+
+
+class LeaseDirectory:
+    """Coordinates workers through lease, heartbeat and marker files in a shared directory.
+
+    Leases are claimed using hard links, which are atomic even on NFS: A uniquely named temporary file is linked to the
+    lease file name, and the claim succeeded if the link count of the temporary file is 2 afterwards (this also catches
+    the case where the server performed the link but the reply got lost).
+
+    Every lease and heartbeat file contains its expiry time. Since expiry times are compared across hosts, the TTL
+    should be much larger than the expected clock skew between them.
+
+    A lease file is never modified after it has been claimed. Each claim has a unique ID, and leases are renewed by
+    updating a renewal file specific to that claim; this way, a worker whose lease was broken (e. g. because it stalled
+    for longer than the TTL) cannot overwrite the lease of the worker which claimed the job after it.
+    """
+    def __init__(self, path, ttl=300):
+        """Create a new lease directory object. The directory is created if it does not exist.
+
+        :param path: Path of the shared directory.
+        :type path: str
+        :param ttl: Lifetime of leases and heartbeats in seconds.
+        :type ttl: float
+        :raises OSError: If the directory cannot be created.
+        """
+        self._path = path
+        self.ttl = ttl
+        self._claims = {}
+        self._claims_lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, *parts):
+        return os.path.join(self._path, ".".join(_safe_name(part) for part in parts))
+
+    def _write_atomically(self, path, data):
+        """Write a JSON document to a file by writing to a temporary file first and renaming that file."""
+        tmp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+
+        with open(tmp_path, "w") as fh:
+            json.dump(data, fh)
+
+        os.rename(tmp_path, path)
+
+    @staticmethod
+    def _read(path):
+        """Read a JSON document from a file.
+
+        :return: The decoded document or ``None`` if the file does not exist or is incomplete.
+        :rtype: dict | None
+        """
+        try:
+            with open(path, "r") as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # Partially written or garbled; treat as absent.
+            return None
+
+    def _is_expired(self, data):
+        return data is None or data.get("expires", 0) < time.time()
+
+    @staticmethod
+    def _renewal_file(lease_path, claim):
+        return "{}.{}.renewal".format(lease_path, _safe_name(claim))
+
+    def _is_lease_expired(self, lease_path, data):
+        """Check whether a lease has expired, taking renewals (see :meth:`renew`) into account."""
+        if not self._is_expired(data):
+            return False
+
+        if data is None or "claim" not in data:
+            return True
+
+        return self._is_expired(self._read(self._renewal_file(lease_path, data["claim"])))
+
+    @staticmethod
+    def _unlink_quietly(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def heartbeat(self, worker):
+        """Record that a worker is alive.
+
+        :param worker: Worker name.
+        :type worker: str
+        :return: Nothing.
+        :rtype: None
+        """
+        self._write_atomically(
+                self._file("worker", worker, "alive"),
+                {"host": socket.gethostname(), "pid": os.getpid(), "expires": time.time() + self.ttl}
+        )
+
+    def is_alive(self, worker):
+        """Check whether a worker has sent a heartbeat recently.
+
+        :param worker: Worker name.
+        :type worker: str
+        :rtype: bool
+        """
+        return not self._is_expired(self._read(self._file("worker", worker, "alive")))
+
+    def claim(self, job, worker):
+        """Try to claim the lease for a job. An expired lease is broken and claimed.
+
+        :param job: Job key.
+        :type job: str
+        :param worker: Name of the claiming worker.
+        :type worker: str
+        :return: ``True`` if the lease was claimed, ``False`` if another worker holds it.
+        :rtype: bool
+        :raises OSError: On file system errors.
+        """
+        lease_path = self._file(job, "lease")
+        claim = uuid.uuid4().hex
+        tmp_path = "{}.{}.claim".format(lease_path, claim)
+
+        with open(tmp_path, "w") as fh:
+            json.dump(
+                    {"worker": worker, "host": socket.gethostname(), "claim": claim, "expires": time.time() + self.ttl},
+                    fh
+            )
+
+        try:
+            for attempt in range(2):
+                try:
+                    os.link(tmp_path, lease_path)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+
+                if os.stat(tmp_path).st_nlink == 2:
+                    with self._claims_lock:
+                        self._claims[job] = claim
+
+                    return True
+
+                if attempt == 0 and not self._break_expired(lease_path):
+                    return False
+
+            return False
+        finally:
+            os.unlink(tmp_path)
+
+    def _break_expired(self, lease_path):
+        """Remove a lease file if it has expired.
+
+        :return: ``True`` if the lease was removed (or vanished in the meantime), ``False`` if it is still valid.
+        :rtype: bool
+        """
+        data = self._read(lease_path)
+        if not self._is_lease_expired(lease_path, data):
+            return False
+
+        # Rename instead of unlinking so that only one of several competing workers breaks the lease.
+        stale_path = "{}.{}.stale".format(lease_path, uuid.uuid4().hex)
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return True
+
+        stale_data = self._read(stale_path)
+        if not self._is_lease_expired(lease_path, stale_data):
+            # Someone else broke the lease and claimed it between our read and our rename; give it back.
+            try:
+                os.link(stale_path, lease_path)
+            except OSError:
+                pass
+            os.unlink(stale_path)
+            return False
+
+        _logger.info("Broke expired lease held by worker %s", data.get("worker") if data else None)
+        os.unlink(stale_path)
+
+        if stale_data is not None and "claim" in stale_data:
+            self._unlink_quietly(self._renewal_file(lease_path, stale_data["claim"]))
+
+        return True
+
+    def renew(self, job, worker):
+        """Extend a lease held by a worker.
+
+        :param job: Job key.
+        :type job: str
+        :param worker: Name of the worker holding the lease.
+        :type worker: str
+        :return: ``True`` if the lease was renewed, ``False`` if the worker does not hold it (anymore).
+        :rtype: bool
+        """
+        lease_path = self._file(job, "lease")
+
+        with self._claims_lock:
+            claim = self._claims.get(job)
+
+        data = self._read(lease_path)
+        if claim is None or data is None or data.get("claim") != claim:
+            return False
+
+        # Only our own renewal file is written. If the lease is broken and claimed by someone else right now, then this
+        # merely renews a claim which does not exist anymore.
+        self._write_atomically(
+                self._renewal_file(lease_path, claim),
+                {"worker": worker, "expires": time.time() + self.ttl}
+        )
+        return True
+
+    def release(self, job, worker):
+        """Release a lease held by a worker.
+
+        :param job: Job key.
+        :type job: str
+        :param worker: Name of the worker holding the lease.
+        :type worker: str
+        :return: Nothing.
+        :rtype: None
+        """
+        lease_path = self._file(job, "lease")
+
+        with self._claims_lock:
+            claim = self._claims.pop(job, None)
+
+        if claim is None:
+            return
+
+        # Rename first and check the claim afterwards, so that we cannot remove a lease claimed by someone else in the
+        # meantime (see _break_expired()).
+        stale_path = "{}.{}.stale".format(lease_path, uuid.uuid4().hex)
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            pass
+        else:
+            data = self._read(stale_path)
+            if data is None or data.get("claim") != claim:
+                # Not our lease (anymore); give it back.
+                try:
+                    os.link(stale_path, lease_path)
+                except OSError:
+                    pass
+            os.unlink(stale_path)
+
+        self._unlink_quietly(self._renewal_file(lease_path, claim))
+
+    def mark_finished(self, job, run, worker, status):
+        """Record the outcome of a job for a run, so that other workers do not process it again (see
+        :func:`run_sharded` for how failed jobs are handled).
+
+        :param job: Job key.
+        :type job: str
+        :param run: Run key (identifies a single run of all jobs, e. g. the report end date).
+        :type run: str
+        :param worker: Name of the worker which processed the job.
+        :type worker: str
+        :param status: Status code returned by the job.
+        :type status: int
+        :return: Nothing.
+        :rtype: None
+        """
+        self._write_atomically(
+                self._file(job, run, "finished"),
+                {"worker": worker, "host": socket.gethostname(), "status": status, "time": time.time()}
+        )
+
+    def get_result(self, job, run):
+        """Get the outcome of a job for a run, as recorded by :meth:`mark_finished`.
+
+        :param job: Job key.
+        :type job: str
+        :param run: Run key.
+        :type run: str
+        :return: ``dict`` with the keys ``worker``, ``host``, ``status`` and ``time``, or ``None`` if the job has not
+            finished yet.
+        :rtype: dict | None
+        """
+        return self._read(self._file(job, run, "finished"))
+
+    def load_job_state(self, job):
+        """Get the state stored for a job, see :meth:`save_job_state`.
+
+        :param job: Job key.
+        :type job: str
+        :return: The stored state or ``None`` if no state has been stored yet.
+        :rtype: dict | None
+        """
+        return self._read(self._file(job, "state"))
+
+    def save_job_state(self, job, state):
+        """Store state for a job which must be shared by all workers (e. g. the end date of the last report).
+
+        :param job: Job key.
+        :type job: str
+        :param state: JSON-serializable state.
+        :type state: dict
+        :return: Nothing.
+        :rtype: None
+        :raises OSError: If the state cannot be written.
+        """
+        self._write_atomically(self._file(job, "state"), state)
+
+    def join_run(self, run, data):
+        """Determine the run to take part in.
+
+        Workers which start within the TTL of each other join the same run, even if they propose different run keys
+        (e. g. because their clocks are on either side of midnight): The first worker starts the run, the others
+        adopt its key and data.
+
+        :param run: Key of the run to start if no other worker started one recently.
+        :type run: str
+        :param data: JSON-serializable data describing the run (e. g. the report end date), shared with the other
+            workers.
+        :type data: dict
+        :return: Tuple of (run key, run data) of the run joined.
+        :rtype: (str, dict)
+        :raises OSError: If the run file cannot be written.
+        """
+        path = self._file("current", "run")
+        current = self._read(path)
+
+        if current is not None and current.get("started", 0) + self.ttl > time.time():
+            if current["run"] != run:
+                _logger.info("Joining run %s started by another worker", current["run"])
+
+            return current["run"], current["data"]
+
+        self._write_atomically(path, {"run": run, "data": data, "started": time.time()})
+        return run, data
+
+
+class _Renewer(threading.Thread):
+    """Background thread renewing a worker's heartbeat and (optionally) the lease of the job it is running."""
+    def __init__(self, leases, worker):
+        super().__init__(daemon=True)
+
+        self._leases = leases
+        self._worker = worker
+        self._stop_event = threading.Event()
+        self.job = None
+
+    def run(self):
+        while not self._stop_event.wait(self._leases.ttl / 3):
+            try:
+                self._leases.heartbeat(self._worker)
+
+                job = self.job
+                if job is not None and not self._leases.renew(job, self._worker):
+                    _logger.warning("Lost lease for job %s", job)
+            except OSError as e:
+                _logger.warning("Cannot renew heartbeat/lease: %s", e)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def run_sharded(jobs, run_job, leases, worker_index, worker_count, run, poll_interval=10):
+    """Run the share of jobs assigned to this worker and take over the jobs of workers which died.
+
+    Jobs are assigned to workers by consistent hashing. A worker first processes its own jobs; jobs of other workers
+    are only taken over if their lease expired (the worker died while processing them) or if their worker has not sent
+    a heartbeat for longer than the lease TTL (the worker died before processing them, or never started).
+
+    A job which failed is not processed again by another worker during the same invocation, but the next invocation
+    for the same run retries it.
+
+    This function returns once every job has finished (on any worker) or was attempted by this worker.
+
+    :param jobs: Job keys.
+    :type jobs: list[str]
+    :param run_job: Function called with a job key to process a job. Must return a status code (0 means success).
+    :type run_job: (str) -> int
+    :param leases: Shared lease directory.
+    :type leases: LeaseDirectory
+    :param worker_index: Index of this worker, from 0 to ``worker_count - 1``.
+    :type worker_index: int
+    :param worker_count: Total number of workers.
+    :type worker_count: int
+    :param run: Run key, e. g. the report end date. Jobs are processed once per run.
+    :type run: str
+    :param poll_interval: Time (in seconds) to wait before checking again for jobs to take over.
+    :type poll_interval: float
+    :return: Mapping from job keys to status codes. Contains the jobs processed by this worker only.
+    :rtype: dict[str, int]
+    """
+    ring = HashRing(str(index) for index in range(worker_count))
+    me = str(worker_index)
+    started = time.time()
+    results = {}
+
+    leases.heartbeat(me)
+    renewer = _Renewer(leases, me)
+    renewer.start()
+
+    def is_settled(job):
+        # Finished successfully, or failed on another worker since we started (failures of earlier invocations are
+        # retried).
+        result = leases.get_result(job, run)
+        return result is not None and (result.get("status") == 0 or result.get("time", 0) >= started)
+
+    try:
+        while True:
+            remaining = [job for job in jobs if job not in results and not is_settled(job)]
+            if not remaining:
+                break
+
+            # Own jobs first, then jobs of other workers which are (presumably) dead.
+            candidates = [job for job in remaining if ring.get_worker(job) == me]
+            if time.time() - started > leases.ttl:
+                candidates += [
+                    job for job in remaining
+                    if ring.get_worker(job) != me and not leases.is_alive(ring.get_worker(job))
+                ]
+
+            claimed_any = False
+            for job in candidates:
+                if not leases.claim(job, me):
+                    # Either in progress elsewhere or just finished; re-check later.
+                    continue
+
+                claimed_any = True
+
+                # The job might have been finished by someone else between our check and our claim.
+                if is_settled(job):
+                    leases.release(job, me)
+                    continue
+
+                if ring.get_worker(job) != me:
+                    _logger.info("Taking over job %s from worker %s", job, ring.get_worker(job))
+
+                renewer.job = job
+                try:
+                    status = run_job(job)
+                finally:
+                    renewer.job = None
+
+                results[job] = status
+                leases.mark_finished(job, run, me, status)
+                leases.release(job, me)
+
+            if not claimed_any:
+                _logger.debug("Waiting for %d job(s) processed by other workers", len(remaining))
+                time.sleep(poll_interval)
+                leases.heartbeat(me)
+    finally:
+        renewer.stop()
+
+    return results
@@ -0,0 +1,309 @@
+"""Stores compact snapshots of summary reports and computes the differences between them.
+
+This file is part of toggl-fetch, see https://github.com/Tblue/toggl-fetch.
+
+Copyright 2016  Tilman Blumenbach
+
+toggl-fetch is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+toggl-fetch is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
+"""
+
+import collections
+import json
+import os
+import os.path
+import re
+import threading
+import time
+
+from . import report
+
+
+# Fields identifying a snapshot row. Rows with the same key are compared when diffing snapshots.
+KEY_FIELDS = ("client", "project", "user", "currency")
+
+# Number of decimal places amounts are rounded to (cents), so that sums of floats compare equal when diffing.
+AMOUNT_DIGITS = 2
+
+
+def make_snapshot(summary, workspace_id, since, until):
+    """Create a compact snapshot of a summary report.
+
+    A snapshot is a ``dict`` with the keys ``workspace``, ``since``, ``until``, ``created`` (UNIX timestamp) and
+    ``rows``. ``rows`` is a list of ``[client, project, user, currency, time, amount]`` lists, where ``time`` is given
+    in milliseconds and ``amount`` is rounded to :const:`AMOUNT_DIGITS` decimal places.
+
+    :param summary: Summary report (requested using :const:`.report.SUMMARY_PARAMS`).
+    :type summary: dict
+    :param workspace_id: ID of the workspace the report belongs to.
+    :type workspace_id: str | int
+    :param since: First day of the report period (ISO 8601 date).
+    :type since: str
+    :param until: Last day of the report period (ISO 8601 date).
+    :type until: str
+    :return: The snapshot.
+    :rtype: dict
+    """
+    totals = collections.OrderedDict()
+
+    for row in report.flatten_summary(summary):
+        key = (row.client, row.project, row.user, row.currency or "")
+        time_total, amount_total = totals.get(key, (0, 0))
+        totals[key] = (time_total + row.time, amount_total + row.amount)
+
+    return {
+        "workspace": str(workspace_id),
+        "since": since,
+        "until": until,
+        "created": time.time(),
+        "rows": [
+            list(key) + [time_total, round(amount_total, AMOUNT_DIGITS)]
+            for key, (time_total, amount_total) in totals.items()
+        ],
+    }
+
+
+def get_snapshot_path(snapshot_dir, workspace_id, since, until):
+    """Get the path of the snapshot file for a workspace and report period.
+
+    :param snapshot_dir: Directory containing all snapshots.
+    :type snapshot_dir: str
+    :param workspace_id: Workspace ID.
+    :type workspace_id: str | int
+    :param since: First day of the report period (ISO 8601 date).
+    :type since: str
+    :param until: Last day of the report period (ISO 8601 date).
+    :type until: str
+    :return: Path of the snapshot file.
+    :rtype: str
+    """
+    return os.path.join(snapshot_dir, str(workspace_id), "{}_{}.json".format(since, until))
+
+
+def _list_periods(snapshot_dir, workspace_id):
+    """List the report periods of all snapshots of a workspace.
+
+    :return: List of (since, until, path) tuples.
+    :rtype: list[(str, str, str)]
+    :raises OSError: If the snapshot directory exists, but cannot be read.
+    """
+    workspace_dir = os.path.join(snapshot_dir, str(workspace_id))
+
+    try:
+        names = os.listdir(workspace_dir)
+    except FileNotFoundError:
+        return []
+
+    periods = []
+    for name in names:
+        match = re.fullmatch(r"([0-9-]+)_([0-9-]+)\.json", name)
+        if match is not None:
+            periods.append((match.group(1), match.group(2), os.path.join(workspace_dir, name)))
+
+    return periods
+
+
+def find_latest_period(snapshot_dir, workspace_id):
+    """Find the report period of the most recently stored snapshot of a workspace.
+
+    :param snapshot_dir: Directory containing all snapshots.
+    :type snapshot_dir: str
+    :param workspace_id: Workspace ID.
+    :type workspace_id: str | int
+    :return: Tuple of (since, until) as ISO 8601 dates, or ``None`` if there are no snapshots.
+    :rtype: (str, str) | None
+    :raises OSError: If the snapshot directory exists, but cannot be read.
+    """
+    latest = None
+
+    for since, until, path in _list_periods(snapshot_dir, workspace_id):
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            continue
+
+        if latest is None or mtime > latest[0]:
+            latest = (mtime, since, until)
+
+    return latest[1:] if latest is not None else None
+
+
+def find_previous_snapshot(snapshot_dir, workspace_id, since, until):
+    """Find the snapshot to compare a new snapshot of a workspace and report period with.
+
+    This is the snapshot with the same start date and the latest end date up to the given one, so that a report period
+    which grew since the last snapshot (e. g. because its end date is "today") is compared with the previous snapshot
+    of the shorter period.
+
+    :param snapshot_dir: Directory containing all snapshots.
+    :type snapshot_dir: str
+    :param workspace_id: Workspace ID.
+    :type workspace_id: str | int
+    :param since: First day of the report period (ISO 8601 date).
+    :type since: str
+    :param until: Last day of the report period (ISO 8601 date).
+    :type until: str
+    :return: Path of the snapshot file, or ``None`` if there is no matching snapshot.
+    :rtype: str | None
+    :raises OSError: If the snapshot directory exists, but cannot be read.
+    """
+    # ISO 8601 dates can be compared as strings.
+    candidates = [
+        snapshot_until
+        for snapshot_since, snapshot_until, _ in _list_periods(snapshot_dir, workspace_id)
+        if snapshot_since == since and snapshot_until <= until
+    ]
+
+    if not candidates:
+        return None
+
+    return get_snapshot_path(snapshot_dir, workspace_id, since, max(candidates))
+
+
+def load_snapshot(path):
+    """Load a snapshot from a file.
+
+    :param path: Path of the snapshot file.
+    :type path: str
+    :return: The snapshot, or ``None`` if the file does not exist.
+    :rtype: dict | None
+    :raises OSError: If the file exists, but cannot be read.
+    :raises json.JSONDecodeError: If the file is corrupt.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def save_snapshot(path, snapshot):
+    """Save a snapshot to a file (atomically, by writing to a temporary file first).
+
+    :param path: Path of the snapshot file. Missing parent directories are created.
+    :type path: str
+    :param snapshot: Snapshot to save, see :func:`make_snapshot`.
+    :type snapshot: dict
+    :return: Nothing.
+    :rtype: None
+    :raises OSError: If the file cannot be written.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(snapshot, fh, separators=(",", ":"))
+
+    os.replace(tmp_path, path)
+
+
+def _rows_by_key(snapshot):
+    if snapshot is None:
+        return collections.OrderedDict()
+
+    # Snapshots stored by older versions contain unrounded amounts.
+    return collections.OrderedDict(
+            (tuple(row[:4]), (row[4], round(row[5], AMOUNT_DIGITS))) for row in snapshot["rows"]
+    )
+
+
+def _totals(rows):
+    time_total = 0
+    amounts = collections.OrderedDict()
+
+    for key, (time_, amount) in rows.items():
+        time_total += time_
+        amounts[key[3]] = round(amounts.get(key[3], 0) + amount, AMOUNT_DIGITS)
+
+    return time_total, amounts
+
+
+def diff_snapshots(old, new):
+    """Compute the differences between two snapshots of the same workspace and period.
+
+    The result is a ``dict`` with the following keys:
+
+    - ``workspace``, ``since``, ``until``: Taken from the new snapshot.
+    - ``previous``: Creation time of the old snapshot (UNIX timestamp), ``None`` if there is no old snapshot.
+    - ``added``, ``changed``, ``removed``: Lists of rows (as ``dict`` objects with the keys in :const:`KEY_FIELDS`
+      plus ``time`` and ``amount``) which were added, changed or removed. Changed rows also contain the keys
+      ``time_delta`` and ``amount_delta``.
+    - ``totals``: ``dict`` with the new total ``time``, the new total ``amount`` per currency and the corresponding
+      ``time_delta`` and ``amount_delta`` values.
+
+    All amounts are rounded to :const:`AMOUNT_DIGITS` decimal places, so that floating point errors are neither
+    reported as changes nor show up in the deltas.
+
+    :param old: Old snapshot, or ``None`` if there is none (then all rows of the new snapshot are reported as added).
+    :type old: dict | None
+    :param new: New snapshot.
+    :type new: dict
+    :return: The differences, as described above.
+    :rtype: dict
+    """
+    old_rows = _rows_by_key(old)
+    new_rows = _rows_by_key(new)
+
+    def to_dict(key, time_, amount):
+        result = collections.OrderedDict(zip(KEY_FIELDS, key))
+        result["time"] = time_
+        result["amount"] = amount
+        return result
+
+    added = []
+    changed = []
+    for key, (time_, amount) in new_rows.items():
+        if key not in old_rows:
+            added.append(to_dict(key, time_, amount))
+            continue
+
+        old_time, old_amount = old_rows[key]
+        if (time_, amount) != (old_time, old_amount):
+            row = to_dict(key, time_, amount)
+            row["time_delta"] = time_ - old_time
+            row["amount_delta"] = round(amount - old_amount, AMOUNT_DIGITS)
+            changed.append(row)
+
+    removed = [to_dict(key, time_, amount) for key, (time_, amount) in old_rows.items() if key not in new_rows]
+
+    old_time, old_amounts = _totals(old_rows)
+    new_time, new_amounts = _totals(new_rows)
+
+    return collections.OrderedDict((
+        ("workspace", new["workspace"]),
+        ("since", new["since"]),
+        ("until", new["until"]),
+        ("previous", old["created"] if old is not None else None),
+        ("added", added),
+        ("changed", changed),
+        ("removed", removed),
+        ("totals", collections.OrderedDict((
+            ("time", new_time),
+            ("amount", new_amounts),
+            ("time_delta", new_time - old_time),
+            ("amount_delta", collections.OrderedDict(
+                    (currency, round(new_amounts.get(currency, 0) - old_amounts.get(currency, 0), AMOUNT_DIGITS))
+                    for currency in sorted(set(old_amounts) | set(new_amounts))
+            )),
+        ))),
+    ))
+
+
+def is_empty_diff(diff):
+    """Check whether a diff computed by :func:`diff_snapshots` contains any changes.
+
+    :param diff: The diff.
+    :type diff: dict
+    :rtype: bool
+    """
+    return not (diff["added"] or diff["changed"] or diff["removed"])
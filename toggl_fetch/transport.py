@@ -0,0 +1,345 @@
+"""Provides pluggable HTTP transport backends for the Toggl.com API clients.
+
+All backends raise the same exceptions as the ``requests`` library (:class:`requests.exceptions.ConnectionError`,
+:class:`requests.exceptions.Timeout` and :class:`requests.exceptions.HTTPError`) and return response objects which
+provide the subset of the :class:`requests.models.Response` interface used by the API clients, so error handling is
+identical for all backends.
+
+This file is part of toggl-fetch, see https://github.com/Tblue/toggl-fetch.
+
+Copyright 2016  Tilman Blumenbach
+
+toggl-fetch is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+toggl-fetch is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with toggl-fetch.  If not, see http://www.gnu.org/licenses/.
+"""
+
+import base64
+import codecs
+import email.message
+import importlib.util
+import json
+import logging
+from abc import *
+from urllib.parse import urlencode, urljoin
+
+import requests
+import requests.exceptions
+import requests.structures
+
+
+# The logger used by this module
+_logger = logging.getLogger(__name__)
+
+
+class TransportUnavailableError(Exception):
+    """Raised if a transport backend cannot be used because the library it needs is not installed."""
+    pass
+
+
+class _Request:
+    """Minimal stand-in for :class:`requests.models.PreparedRequest`, only providing the requested URL."""
+    def __init__(self, url):
+        self.url = url
+
+
+class TransportResponse:
+    """An HTTP response, providing the parts of the :class:`requests.models.Response` interface used by the API
+    clients.
+    """
+    def __init__(self, status_code, reason, headers, content, url, request_url, close=None):
+        """Create a new response object.
+
+        :param status_code: HTTP status code.
+        :type status_code: int
+        :param reason: HTTP reason phrase.
+        :type reason: str
+        :param headers: Response headers.
+        :type headers: collections.abc.Mapping
+        :param content: Response body.
+        :type content: bytes
+        :param url: Final URL of the response (after redirects).
+        :type url: str
+        :param request_url: Originally requested URL.
+        :type request_url: str
+        :param close: Function releasing the underlying connection, if any.
+        :type close: () -> None
+        """
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.content = content
+        self.url = url
+        self.request = _Request(request_url)
+        self._close = close
+
+    @property
+    def encoding(self):
+        """The character set of the response body according to the ``Content-Type`` header (``None`` if missing or
+        unknown).
+        """
+        message = email.message.Message()
+        message["content-type"] = self.headers.get("content-type", "")
+        charset = message.get_content_charset()
+
+        if charset is None:
+            return None
+
+        try:
+            return codecs.lookup(charset).name
+        except LookupError:
+            _logger.debug("Unknown response charset: %s", charset)
+            return None
+
+    def json(self):
+        """Decode the response body as JSON.
+
+        The body is decoded using the character set of the response (UTF-8 by default). Invalid characters are
+        replaced, so that they end up in the decoded strings instead of causing an error.
+
+        :return: The decoded document.
+        :rtype: object
+        :raises json.JSONDecodeError: If the body is not valid JSON.
+        """
+        return json.loads(self.content.decode(self.encoding or "utf-8", errors="replace"))
+
+    def raise_for_status(self):
+        """Raise an exception if the status code denotes an error.
+
+        Behaves like :meth:`requests.models.Response.raise_for_status`.
+
+        :raises requests.exceptions.HTTPError: If the status code is 400 or higher.
+        """
+        if 400 <= self.status_code < 500:
+            kind = "Client Error"
+        elif 500 <= self.status_code < 600:
+            kind = "Server Error"
+        else:
+            return
+
+        raise requests.exceptions.HTTPError(
+                "%d %s: %s for url: %s" % (self.status_code, kind, self.reason, self.url),
+                response=self
+        )
+
+    def close(self):
+        """Release the underlying connection."""
+        if self._close is not None:
+            self._close()
+
+
+class Transport(metaclass=ABCMeta):
+    """Base class for transport backends. A transport performs authenticated HTTP GET requests."""
+    def __init__(self, auth, user_agent):
+        """Create a new transport.
+
+        :param auth: Credentials for HTTP basic authentication: Tuple of (username, password).
+        :type auth: (str, str)
+        :param user_agent: User agent string to send.
+        :type user_agent: str
+        """
+        self._auth = auth
+        self._user_agent = user_agent
+
+    def _get_default_headers(self):
+        """Get the headers to send with every request (authentication and user agent)."""
+        credentials = base64.b64encode(("%s:%s" % self._auth).encode("utf-8")).decode("ascii")
+
+        return {
+            "Authorization": "Basic " + credentials,
+            "User-Agent": self._user_agent,
+        }
+
+    def _get_query(self, params):
+        """Get the query string parameters to send, including the ``user_agent`` parameter Toggl.com asks for."""
+        query = {"user_agent": self._user_agent}
+        query.update((name, str(value)) for name, value in params.items())
+
+        return query
+
+    @abstractmethod
+    def get(self, url, params):
+        """Perform an HTTP GET request.
+
+        :param url: URL to request.
+        :type url: str
+        :param params: Query string parameters. Values are converted to ``str``.
+        :type params: dict
+        :return: HTTP response.
+        :rtype: requests.models.Response | TransportResponse
+        :raises requests.exceptions.ConnectionError: If a connection error occurs.
+        :raises requests.exceptions.Timeout: If the request times out.
+        """
+        pass
+
+    def close(self):
+        """Close all connections held by this transport.
+
+        :return: Nothing.
+        :rtype: None
+        """
+        pass
+
+
+class RequestsTransport(Transport):
+    """Transport using a ``requests`` session. This is the default."""
+    def __init__(self, auth, user_agent, session=None):
+        """Create a new transport.
+
+        :param auth: See :class:`Transport`.
+        :type auth: (str, str)
+        :param user_agent: See :class:`Transport`.
+        :type user_agent: str
+        :param session: Session to use; must already be set up for authentication and the user agent. If ``None``,
+            then a new session is created.
+        :type session: requests.sessions.Session | None
+        """
+        super().__init__(auth, user_agent)
+
+        if session is None:
+            session = requests.Session()
+            session.auth = auth
+            session.headers["user-agent"] = user_agent
+            session.params["user_agent"] = user_agent
+
+        self._session = session
+
+    def get(self, url, params):
+        return self._session.get(url, params=params)
+
+    def close(self):
+        self._session.close()
+
+
+class Urllib3Transport(Transport):
+    """Transport using ``urllib3`` directly, avoiding the per-request overhead of ``requests``."""
+    def __init__(self, auth, user_agent, maxsize=10):
+        """Create a new transport.
+
+        :param auth: See :class:`Transport`.
+        :type auth: (str, str)
+        :param user_agent: See :class:`Transport`.
+        :type user_agent: str
+        :param maxsize: Maximum number of connections to keep per host.
+        :type maxsize: int
+        :raises TransportUnavailableError: If ``urllib3`` is not installed.
+        """
+        super().__init__(auth, user_agent)
+
+        try:
+            import urllib3
+            import urllib3.exceptions
+        except ImportError as e:
+            raise TransportUnavailableError("The urllib3 transport needs the urllib3 package") from e
+
+        self._exceptions = urllib3.exceptions
+        self._pool = urllib3.PoolManager(
+                maxsize=maxsize,
+                headers=self._get_default_headers(),
+                # Like requests: Follow redirects, but don't retry failed requests (the API clients do that).
+                retries=urllib3.Retry(total=None, connect=0, read=False, status=0, redirect=30)
+        )
+
+    def get(self, url, params):
+        request_url = url + "?" + urlencode(self._get_query(params))
+
+        try:
+            resp = self._pool.request("GET", request_url, preload_content=True)
+        except (self._exceptions.TimeoutError, self._exceptions.MaxRetryError) as e:
+            reason = getattr(e, "reason", e)
+            if isinstance(reason, self._exceptions.TimeoutError):
+                raise requests.exceptions.Timeout(str(e)) from e
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        except self._exceptions.HTTPError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+
+        # Determine the final URL (after redirects).
+        final_url = request_url
+        if resp.retries is not None and resp.retries.history:
+            final_url = urljoin(request_url, resp.retries.history[-1].redirect_location)
+
+        return TransportResponse(
+                resp.status,
+                resp.reason,
+                resp.headers,
+                resp.data,
+                final_url,
+                request_url,
+                resp.release_conn
+        )
+
+    def close(self):
+        self._pool.clear()
+
+
+class HttpxTransport(Transport):
+    """Transport using ``httpx``. If the ``h2`` package is installed, then HTTP/2 is used for HTTPS connections, so that
+    concurrent requests are multiplexed over a single connection.
+    """
+    def __init__(self, auth, user_agent):
+        """Create a new transport.
+
+        :param auth: See :class:`Transport`.
+        :type auth: (str, str)
+        :param user_agent: See :class:`Transport`.
+        :type user_agent: str
+        :raises TransportUnavailableError: If ``httpx`` is not installed.
+        """
+        super().__init__(auth, user_agent)
+
+        try:
+            import httpx
+        except ImportError as e:
+            raise TransportUnavailableError("The httpx transport needs the httpx package") from e
+
+        # httpx only needs h2 to be importable; it imports the package itself.
+        http2 = importlib.util.find_spec("h2") is not None
+        if not http2:
+            _logger.debug("h2 package not installed, httpx transport will use HTTP/1.1 only")
+
+        self._httpx = httpx
+        # Report generation can take a long time, so don't use httpx's default timeout (requests has none either).
+        self._client = httpx.Client(
+                headers=self._get_default_headers(),
+                http2=http2,
+                timeout=None,
+                follow_redirects=True
+        )
+
+    def get(self, url, params):
+        try:
+            resp = self._client.get(url, params=self._get_query(params))
+        except self._httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except self._httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+
+        return TransportResponse(
+                resp.status_code,
+                resp.reason_phrase,
+                resp.headers,
+                resp.content,
+                str(resp.url),
+                str(resp.request.url if not resp.history else resp.history[0].request.url),
+                resp.close
+        )
+
+    def close(self):
+        self._client.close()
+
+
+# Available transport backends, by name.
+TRANSPORTS = {
+    "requests": RequestsTransport,
+    "urllib3": Urllib3Transport,
+    "httpx": HttpxTransport,
+}